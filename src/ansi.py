@@ -0,0 +1,244 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains a minimal stand-in for a curses window that draws with
+    plain ANSI escape sequences on a pair of file descriptors: a network
+    connection (see server.py), or the local terminal (see wrapper, used by
+    main.py --renderer ansi). Each frame is composed in preallocated row
+    buffers and sent as one write containing only the spans that changed.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import select
+import sys
+
+DEFAULT_ROWS = 24
+DEFAULT_COLS = 80
+
+# changed spans of a row that are separated by fewer unchanged columns than
+# this are sent as one span (rewriting a few columns is cheaper than moving)
+SPAN_GAP = 6
+
+ESC = b'\x1b'
+CLEAR_SCREEN = ESC + b'[2J'
+CLEAR_TO_EOL = ESC + b'[K'
+ALT_SCREEN_ON  = ESC + b'[?1049h'
+ALT_SCREEN_OFF = ESC + b'[?1049l'
+
+# terminal size report ("ESC [ 8 ; rows ; cols t", as sent by xterm and by
+# our client when its window is resized)
+SIZE_REPORT = re.compile(rb'\x1b\[8;(\d+);(\d+)t')
+SIZE_PREFIX = ESC + b'[8;'
+SIZE_REQUEST = ESC + b'[18t'    # asks the terminal for a size report
+
+def changed_spans(old, new, gap=SPAN_GAP):
+    '''
+    returns the [start, end) column ranges in which two equal-length rows
+    differ (as a list of [start, end] pairs), merging ranges that are less
+    than gap columns apart
+    '''
+    spans = []
+    diff = int.from_bytes(old, 'little') ^ int.from_bytes(new, 'little')
+    col = 0
+    while diff:
+        # skip to the next differing byte
+        skip = ((diff & -diff).bit_length() - 1) >> 3
+        col += skip
+        diff >>= 8 * (skip + 1)
+        if len(spans) > 0 and col - spans[-1][1] < gap:
+            spans[-1][1] = col + 1
+        else:
+            spans.append([ col, col + 1 ])
+        col += 1
+    return spans
+
+class AnsiScreen:
+    '''
+    Implements the part of the curses window interface that the game uses
+    (addstr, clear, erase, move, refresh, getmaxyx, getch, nodelay,
+    timeout). Drawing goes to an off-screen buffer of one bytearray per row;
+    refresh compares it with what the terminal shows and sends just the
+    changed spans. Like curses, getch refreshes the screen first.
+    '''
+
+    def __init__(self, fd_in, fd_out, rows=DEFAULT_ROWS, cols=DEFAULT_COLS):
+        self.fd_in = fd_in
+        self.fd_out = fd_out
+        self.input = b''        # bytes received but not yet returned by getch
+        self.delay = None       # seconds getch waits for a key (None = forever)
+        self.feed = None        # spectator feed that gets every update too
+        self.resize(rows, cols)
+
+    def resize(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.blank = b' ' * cols
+        self.back = [ bytearray(self.blank) for row in range(rows) ]
+        self.front = None       # what the terminal shows (None = unknown)
+        self.cursor = (0, 0)
+        self.sent_cursor = None # where the terminal's cursor is (if known)
+
+    def getmaxyx(self):
+        return (self.rows, self.cols)
+
+    def erase(self):
+        for line in self.back:
+            line[:] = self.blank
+
+    def clear(self):
+        self.erase()
+
+    def addstr(self, row, col, text):
+        '''
+        draw a string; newlines continue at the start of the next row, and
+        anything that falls off the screen is dropped (characters that aren't
+        ASCII are drawn as '?')
+        '''
+        lines = text.encode('ascii', 'replace').split(b'\n')
+        for i in range(len(lines)):
+            if i > 0:
+                row += 1
+                col = 0
+            if row >= 0 and row < self.rows:
+                start = max(col, 0)
+                visible = lines[i][start - col:max(self.cols - col, 0)]
+                self.back[row][start:start + len(visible)] = visible
+            col += len(lines[i])
+        self.cursor = (min(row, self.rows-1), min(col, self.cols-1))
+
+    def move(self, row, col):
+        self.cursor = (row, col)
+
+    def refresh(self):
+        out = []
+        if self.front is None:
+            out.append(CLEAR_SCREEN)
+            self.front = [ bytearray(self.blank) for row in range(self.rows) ]
+        for row in range(self.rows):
+            line = self.back[row]
+            shown = self.front[row]
+            if line == shown:
+                continue
+            last = None         # end of the span sent last on this row
+            for (start, end) in changed_spans(shown, line):
+                if last is None:
+                    out.append(b'\x1b[%d;%dH' % (row+1, start+1))
+                else:
+                    out.append(b'\x1b[%dC' % (start - last))
+                text = line[start:end]
+                if end == self.cols and text.endswith(b' '):
+                    # (blank out the rest of the row instead of sending spaces)
+                    text = text.rstrip(b' ')
+                    out.append(text + CLEAR_TO_EOL)
+                else:
+                    out.append(text)
+                last = end
+            shown[:] = line
+        if len(out) == 0 and self.cursor == self.sent_cursor:
+            return              # (nothing to send)
+        out.append(b'\x1b[%d;%dH' % (self.cursor[0]+1, self.cursor[1]+1))
+        self.sent_cursor = self.cursor
+        data = b''.join(out)
+        self.write(data)
+        if self.feed is not None:
+            self.feed.publish(data, self.keyframe)
+
+    def keyframe(self):
+        '''
+        encodes everything the terminal shows (for spectators joining a feed)
+        '''
+        out = [ CLEAR_SCREEN ]
+        for row in range(self.rows):
+            line = self.front[row].rstrip(b' ')
+            if len(line) > 0:
+                out.append(b'\x1b[%d;1H' % (row+1))
+                out.append(line)
+        out.append(b'\x1b[%d;%dH' % (self.cursor[0]+1, self.cursor[1]+1))
+        return b''.join(out)
+
+    def write(self, data):
+        '''
+        send data to the terminal (in one write unless the file descriptor
+        takes only part of it)
+        '''
+        while len(data) > 0:
+            data = data[os.write(self.fd_out, data):]
+
+    def nodelay(self, flag):
+        self.delay = 0 if flag else None
+
+    def timeout(self, delay):
+        '''
+        set how long getch waits for a key, in milliseconds (negative means
+        forever), as with curses
+        '''
+        self.delay = None if delay < 0 else delay / 1000.0
+
+    def getch(self):
+        '''
+        returns the next key, or -1 if none arrives in time (see nodelay and
+        timeout); raises EOFError if the terminal has gone away
+        '''
+        self.refresh()
+        while True:
+            match = SIZE_REPORT.match(self.input)
+            if match:
+                self.input = self.input[match.end():]
+                self.resize(int(match.group(1)), int(match.group(2)))
+                continue
+            # (wait for the rest of a size report that was split up)
+            partial = self.input.startswith(SIZE_PREFIX) and \
+                    b't' not in self.input and len(self.input) < 16
+            if len(self.input) > 0 and not partial:
+                c = self.input[0]
+                self.input = self.input[1:]
+                return c
+            if self.delay is not None and \
+                    not select.select([ self.fd_in ], [], [], self.delay)[0]:
+                return -1
+            data = os.read(self.fd_in, 4096)
+            if len(data) == 0:
+                raise EOFError("terminal closed")
+            self.input += data
+
+def wrapper(func, *args):
+    '''
+    the counterpart of curses.wrapper: calls func(screen, *args) with an
+    AnsiScreen on this process's terminal (standard input and output), in raw
+    mode on the alternate screen, and restores the terminal afterwards; when
+    the window is resized the terminal is asked for its new size, which it
+    reports as input (as xterm and most emulators do)
+    '''
+    import signal
+    import termios
+    import tty
+    fd_in = sys.stdin.fileno()
+    fd_out = sys.stdout.fileno()
+    size = os.get_terminal_size(fd_out)
+    screen = AnsiScreen(fd_in, fd_out, size.lines, size.columns)
+    saved = termios.tcgetattr(fd_in)
+    handler = signal.signal(signal.SIGWINCH,
+                            lambda signum, frame: screen.write(SIZE_REQUEST))
+    try:
+        tty.setraw(fd_in)
+        screen.write(ALT_SCREEN_ON)
+        return func(screen, *args)
+    finally:
+        screen.write(ALT_SCREEN_OFF)
+        termios.tcsetattr(fd_in, termios.TCSADRAIN, saved)
+        signal.signal(signal.SIGWINCH, handler)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    Monte Carlo encounter simulator for tuning combat balance. Estimates how a
+    player of a given level fares against each NPC type (or a floor's worth
+    of NPCs) by running many vectorized fights at once:
+
+        python src/balance.py --level 2 --trials 500000 --jobs 4
+
+    Fights are modeled one enemy at a time with the player swinging first;
+    the player quaffs a potion instead of attacking whenever their hit points
+    drop to the enemy's maximum damage or below. Requires NumPy.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy
+
+from game import DEFAULT_NUM_FLOORS
+from geom import Point
+from npc import Bug, Segfault, Spectre
+from player import Player, XP_LEVELS
+
+# chance that an adjacent NPC attacks on its turn (see each NPC's do_turn)
+ATTACK_CHANCE = { Bug: 1.0, Segfault: 0.75, Spectre: 0.25 }
+SPLIT_CHANCE  = 0.33        # see Bug.handle_attack
+MAX_ROUNDS    = 1000        # per enemy type; fights this long count as losses
+
+NPC_TYPES = { "Bug": Bug, "Segfault": Segfault, "Spectre": Spectre }
+
+class QuietGame:
+    '''
+    stand-in for Game when calling player routines that report status
+    '''
+    def add_status(self, msg):
+        pass
+
+def player_at_level(level):
+    '''
+    returns a fresh player that has just reached the given level
+    '''
+    player = Player()
+    player.xp = XP_LEVELS[level-1]
+    player.level_up(QuietGame())
+    player.hp = player.max_hp
+    return player
+
+def npc_stats(npc_type):
+    npc = npc_type(0, Point(0, 0))
+    return (npc.hp, npc.dmg, npc.kxp)
+
+def floor_mix(f, num_floors, trials, rng):
+    '''
+    samples how many of each NPC type are generated on floor f, using the
+    same distributions as the NPC generate routines
+    '''
+    depth = min(f, 8)
+    counts = [ (Bug, rng.integers(0, max(10-f, 1), trials)),
+               (Segfault, rng.integers(depth, (depth+1)*2+1, trials)) ]
+    if f == num_floors-1:
+        counts.append((Spectre, numpy.ones(trials, dtype=numpy.int64)))
+    return counts
+
+def simulate(level, mix, trials, potions, rng):
+    '''
+    run a batch of fights; mix is a list of (NPC type, per-trial count array)
+    pairs fought in order; returns a dictionary of summed statistics
+    '''
+    player = player_at_level(level)
+    hp      = numpy.full(trials, player.hp, dtype=numpy.int64)
+    max_hp  = numpy.full(trials, player.max_hp, dtype=numpy.int64)
+    lvl     = numpy.full(trials, player.level, dtype=numpy.int64)
+    xp      = numpy.full(trials, player.xp, dtype=numpy.int64)
+    left    = numpy.full(trials, potions, dtype=numpy.int64)
+    rounds  = numpy.zeros(trials, dtype=numpy.int64)
+    alive   = numpy.ones(trials, dtype=bool)
+    xp_levels = numpy.array(XP_LEVELS)
+
+    for (npc_type, counts) in mix:
+        (npc_hp, npc_dmg, kxp) = npc_stats(npc_type)
+        remaining = numpy.array(counts, dtype=numpy.int64)
+        enemy_hp = numpy.full(trials, npc_hp, dtype=numpy.int64)
+        for r in range(MAX_ROUNDS):
+            active = alive & (remaining > 0)
+            if not active.any():
+                break
+            rounds += active
+
+            # player's turn: quaff when in danger, otherwise attack
+            quaff = active & (hp <= npc_dmg.max()) & (left > 0)
+            hp = numpy.where(quaff, numpy.minimum(hp + 2 + lvl, max_hp), hp)
+            left -= quaff
+            attack = active & ~quaff
+            enemy_hp -= numpy.where(attack, player.dmg.roll_many(trials, rng), 0)
+
+            # handle kills (bugs may split instead of dying)
+            killed = attack & (enemy_hp <= 0)
+            if npc_type is Bug:
+                split = killed & (rng.random(trials) < SPLIT_CHANCE)
+                enemy_hp[split] = 1
+                remaining += split
+                killed &= ~split
+            remaining -= killed
+            xp += killed * kxp
+            enemy_hp[killed] = npc_hp
+
+            # level ups (possibly several at once)
+            while True:
+                up = xp >= xp_levels[lvl]
+                if not up.any():
+                    break
+                lvl += up
+                hp += 5 * up
+                max_hp += 5 * up
+
+            # enemy's turn
+            hits = active & (remaining > 0) & \
+                   (rng.random(trials) < ATTACK_CHANCE[npc_type])
+            hp -= numpy.where(hits, npc_dmg.roll_many(trials, rng), 0)
+            alive &= hp > 0
+        alive &= remaining == 0
+
+    start_hp = player.hp
+    return { "trials":  trials,
+             "wins":    int(alive.sum()),
+             "hp_lost": int((start_hp - numpy.maximum(hp, 0)).sum()),
+             "potions": int((potions - left).sum()),
+             "xp":      int(xp.sum()),
+             "rounds":  int(rounds.sum()) }
+
+def run_batch(args):
+    '''
+    worker entry point: (scenario, level, trials, potions, seed)
+    '''
+    (scenario, level, trials, potions, seed) = args
+    rng = numpy.random.default_rng(seed)
+    if scenario[0] == "floor":
+        mix = floor_mix(scenario[1], DEFAULT_NUM_FLOORS, trials, rng)
+    else:
+        mix = [ (NPC_TYPES[name], numpy.full(trials, count, dtype=numpy.int64))
+                for (name, count) in scenario[1] ]
+    return simulate(level, mix, trials, potions, rng)
+
+def scenario_name(scenario):
+    if scenario[0] == "floor":
+        return "Floor " + str(scenario[1]+1)
+    return " + ".join([ (str(count) + " " if count > 1 else "") + name
+                        for (name, count) in scenario[1] ])
+
+def parse_mix(spec):
+    '''
+    parse a mix like "Bug" or "3xBug,Segfault"
+    '''
+    mix = []
+    for part in spec.split(','):
+        (count, sep, name) = part.strip().rpartition('x')
+        if name not in NPC_TYPES:
+            raise argparse.ArgumentTypeError("unknown NPC type: " + name)
+        mix.append((name, int(count) if sep else 1))
+    return ("mix", mix)
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo encounter "
+            "simulator for haxcs combat balance")
+    parser.add_argument("--level", type=int, default=1,
+            help="player level (default: %(default)s)")
+    parser.add_argument("--trials", type=int, default=200000,
+            help="fights per scenario (default: %(default)s)")
+    parser.add_argument("--potions", type=int, default=Player().potions,
+            help="potions at the start of each fight (default: %(default)s)")
+    parser.add_argument("--mix", type=parse_mix, action="append",
+            help="NPCs to fight, e.g. Bug or 3xBug,Segfault (may be repeated; "
+                 "default: each NPC type alone, then each floor)")
+    parser.add_argument("--jobs", type=int, default=1,
+            help="worker processes (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=None,
+            help="random seed")
+    args = parser.parse_args()
+
+    if args.mix:
+        scenarios = args.mix
+    else:
+        scenarios = [ ("mix", [ (name, 1) ]) for name in NPC_TYPES ] + \
+                    [ ("floor", f) for f in range(DEFAULT_NUM_FLOORS) ]
+
+    # split every scenario into one batch per job
+    seeds = numpy.random.SeedSequence(args.seed).spawn(len(scenarios) * args.jobs)
+    batches = []
+    for s in range(len(scenarios)):
+        for j in range(args.jobs):
+            trials = args.trials // args.jobs + (1 if j < args.trials % args.jobs else 0)
+            batches.append((scenarios[s], args.level, trials, args.potions,
+                            seeds[s * args.jobs + j]))
+
+    start = time.time()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.map(run_batch, batches)
+        pool.close()
+    else:
+        results = [ run_batch(batch) for batch in batches ]
+    elapsed = time.time() - start
+
+    print ("Level " + str(args.level) + " " + "player, " + str(args.potions) +
+           " potions, " + str(args.trials) + " trials per scenario:")
+    print ("  %-28s   %6s   %7s   %7s   %6s   %6s" % ("SCENARIO", "WIN%",
+           "HP LOST", "POTIONS", "XP", "TURNS"))
+    for s in range(len(scenarios)):
+        total = {}
+        for result in results[s * args.jobs:(s+1) * args.jobs]:
+            for key, value in result.items():
+                total[key] = total.get(key, 0) + value
+        trials = float(total["trials"])
+        print ("  %-28s   %6.2f   %7.2f   %7.2f   %6.2f   %6.1f" % (
+               scenario_name(scenarios[s]), 100.0 * total["wins"] / trials,
+               total["hp_lost"] / trials, total["potions"] / trials,
+               total["xp"] / trials, total["rounds"] / trials))
+    print ("(%d fights in %.2f seconds)" % (args.trials * len(scenarios), elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains an alternative floor generator that grows caves with a
+    cellular automaton, updating the whole grid at once with NumPy so that
+    even very large floors generate quickly.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from floor import Floor
+from geom import Point
+
+INITIAL_ROCK  = 0.45    # fraction of tiles that start out as rock
+FILL_PASSES   = 3       # smoothing passes that also fill in big open areas
+SMOOTH_PASSES = 2       # plain smoothing passes
+
+def neighbor_counts(rock):
+    '''
+    returns the number of rock tiles among each tile's eight neighbors
+    (tiles outside the grid count as rock)
+    '''
+    padded = numpy.pad(rock.astype(numpy.int8), 1, constant_values=1)
+    (height, width) = rock.shape
+    counts = numpy.zeros(rock.shape, dtype=numpy.int8)
+    for dr in (0, 1, 2):
+        for dc in (0, 1, 2):
+            if dr != 1 or dc != 1:
+                counts += padded[dr:dr+height, dc:dc+width]
+    return counts
+
+def dilate(mask):
+    '''
+    returns the tiles in a mask along with their eight neighbors
+    '''
+    padded = numpy.pad(mask, 1)
+    (height, width) = mask.shape
+    grown = numpy.zeros(mask.shape, dtype=bool)
+    for dr in (0, 1, 2):
+        for dc in (0, 1, 2):
+            grown |= padded[dr:dr+height, dc:dc+width]
+    return grown
+
+def label_components(open_tiles):
+    '''
+    connected-component labelling (four-way) of the open tiles, done on
+    horizontal runs of tiles rather than single tiles; returns arrays with
+    the row, start column, and end column (exclusive) of each run, and an
+    array of labels (runs in the same component get the same label)
+    '''
+    (height, width) = open_tiles.shape
+    edges = numpy.diff(numpy.pad(open_tiles.astype(numpy.int8), ((0, 0), (1, 1))))
+    (rows, cols) = numpy.nonzero(edges)
+    (rows, starts, ends) = (rows[0::2], cols[0::2], cols[1::2])
+
+    # runs in adjacent rows are connected if their columns overlap; since
+    # runs are sorted by row and then column, the runs below each run that
+    # overlap it are a contiguous range
+    stride = width + 1
+    below = (rows + 1) * stride
+    first = numpy.searchsorted(rows * stride + ends, below + starts, side='right')
+    last  = numpy.searchsorted(rows * stride + starts, below + ends, side='left')
+    counts = numpy.maximum(last - first, 0)
+    upper = numpy.repeat(numpy.arange(len(rows)), counts)
+    lower = numpy.repeat(first, counts) + numpy.arange(counts.sum()) - \
+            numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+    # every run takes the smallest label among its neighbors (with pointer
+    # jumping to spread labels quickly) until nothing changes
+    labels = numpy.arange(len(rows))
+    while True:
+        smallest = numpy.minimum(labels[upper], labels[lower])
+        new_labels = labels.copy()
+        numpy.minimum.at(new_labels, upper, smallest)
+        numpy.minimum.at(new_labels, lower, smallest)
+        new_labels = new_labels[new_labels]
+        if numpy.array_equal(new_labels, labels):
+            return (rows, starts, ends, labels)
+        labels = new_labels
+
+def generate_cave_floor(width, height, up=None, large=False):
+    '''
+    generate a cave floor: random rock is smoothed into caverns by a
+    cellular automaton, and only the cave region containing the upstairs is
+    kept (so everything on the floor is reachable); the edges of the cave are
+    walls, so the rest of the game treats it like any other floor; the
+    downstairs are put where a room floor (a large one if large is set) could
+    start from them
+    '''
+    if numpy is None:
+        raise ImportError("the cave generator requires NumPy")
+    rng = numpy.random.default_rng(random.getrandbits(64))
+    if up is not None:
+        # the open area around the upstairs stops short of the edge walls
+        around = (slice(max(up.row-1, 1), min(up.row+2, height-1)),
+                  slice(max(up.col-1, 1), min(up.col+2, width-1)))
+
+    # random rock, smoothed into caves
+    rock = rng.random((height, width)) < INITIAL_ROCK
+    for i in range(FILL_PASSES + SMOOTH_PASSES):
+        if up is not None:
+            rock[around] = False
+        counts = neighbor_counts(rock)
+        rock = counts >= 5
+        if i < FILL_PASSES:
+            rock |= counts <= 1
+    rock[0, :] = rock[-1, :] = rock[:, 0] = rock[:, -1] = True
+    if up is not None:
+        rock[around] = False
+
+    # keep the cave containing the upstairs (or the biggest cave)
+    (rows, starts, ends, labels) = label_components(~rock)
+    if up is not None:
+        here = numpy.flatnonzero((rows == up.row) & (starts <= up.col) &
+                                 (ends > up.col))
+        keep = labels[here[0]]
+    else:
+        sizes = numpy.bincount(labels, weights=ends - starts)
+        keep = numpy.argmax(sizes)
+    kept = labels == keep
+    marks = numpy.zeros((height, width + 1), dtype=numpy.int32)
+    numpy.add.at(marks, (rows[kept], starts[kept]), 1)
+    numpy.add.at(marks, (rows[kept], ends[kept]), -1)
+    cave = numpy.cumsum(marks, axis=1)[:, :width] > 0
+
+    # walls are the rock tiles next to the cave; walls with cave beside them
+    # are drawn vertically
+    walls = dilate(cave) & ~cave
+    beside = numpy.zeros((height, width), dtype=bool)
+    beside[:, 1:] |= cave[:, :-1]
+    beside[:, :-1] |= cave[:, 1:]
+    tiles = numpy.full((height, width), ord(' '), dtype=numpy.uint8)
+    tiles[walls] = ord('-')
+    tiles[walls & beside] = ord('|')
+    tiles[cave] = ord('.')
+
+    # stairs: down goes somewhere at least a third of the floor away, if
+    # the cave reaches that far, and where a room floor can start
+    (rows, cols) = numpy.nonzero(cave)
+    if up is None:
+        i = rng.integers(len(rows))
+        up = Point(int(rows[i]), int(cols[i]))
+    distance = numpy.abs(rows - up.row) + numpy.abs(cols - up.col)
+    fits = Floor.fits_upstairs(width, height, large, rows, cols)
+    far = numpy.flatnonzero((distance >= (width + height) // 3) & fits)
+    if len(far) == 0:
+        far = numpy.flatnonzero((distance > 0) & fits)
+    if len(far) == 0:
+        # the cave doesn't reach anywhere the next floor could start
+        return generate_cave_floor(width, height, up, large)
+    i = far[rng.integers(len(far))]
+    down = Point(int(rows[i]), int(cols[i]))
+    tiles[up.row, up.col] = ord('<')
+    tiles[down.row, down.col] = ord('>')
+
+    floor = Floor(width, height, up)
+    floor.down = down
+    floor.set_rows(0, [ tiles[row].tobytes() for row in range(height) ])
+    return floor
+
+
+if __name__ == "__main__":
+    f = generate_cave_floor(80, 25)
+    for row in range(f.height):     # print floor (base only)
+        print (f.base_row(row))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    Dungeon generator corpus runner. Generates many seeded floors across a
+    process pool, streams per-floor metrics to a JSON-lines file, checks the
+    generator's invariants, and prints percentile summaries:
+
+        python src/corpus.py --floors 100000 --jobs 8 --out corpus.jsonl
+
+    Any floor can be reproduced by re-seeding the random module with the seed
+    recorded in its metrics line and calling generate_basic_floor again.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from floor import Floor
+
+PASSABLE = { '.', '#', '+', '<', '>' }     # tiles a player can cross
+
+METRICS = [ "time_ms", "room_attempts", "connect_calls", "restarts",
+            "rooms", "corridor", "stair_dist" ]
+PERCENTILES = [ 50, 90, 99, 99.9 ]
+
+def reachable(floor, start):
+    '''
+    returns the distance to every passable tile reachable from a point
+    '''
+    dist = { (start.row, start.col): 0 }
+    queue = collections.deque([ (start.row, start.col) ])
+    while len(queue) > 0:
+        (row, col) = queue.popleft()
+        for (dr, dc) in [ (-1, 0), (1, 0), (0, -1), (0, 1) ]:
+            nxt = (row + dr, col + dc)
+            if nxt not in dist and floor.get_base(*nxt) in PASSABLE:
+                dist[nxt] = dist[(row, col)] + 1
+                queue.append(nxt)
+    return dist
+
+def check_floor(floor):
+    '''
+    returns a list of the generator invariants that a floor violates
+    '''
+    errors = []
+    for (name, pt) in [ ("up", floor.up), ("down", floor.down) ]:
+        if not any([ pt.row > room.top and pt.row < room.bottom-1 and
+                     pt.col > room.left and pt.col < room.right-1
+                     for room in floor.rooms ]):
+            errors.append(name + " stairs outside of every room")
+    dist = reachable(floor, floor.up)
+    for r in range(len(floor.rooms)):
+        room = floor.rooms[r]
+        if (room.top+1, room.left+1) not in dist:
+            errors.append("room " + str(r) + " unreachable")
+    return (errors, dist.get((floor.down.row, floor.down.col)))
+
+def measure(args):
+    '''
+    worker entry point: generate and check the floor for one seed
+    '''
+    (seed, width, height) = args
+    random.seed(seed)
+    stats = collections.Counter()
+    start = time.perf_counter()
+    try:
+        floor = Floor.generate_basic_floor(width, height, stats=stats)
+    except Exception as e:      # includes RecursionError from runaway restarts
+        return { "seed": seed, "errors": [ "generation failed: " + repr(e) ],
+                 "time_ms": (time.perf_counter() - start) * 1000.0 }
+    elapsed = time.perf_counter() - start
+
+    (errors, stair_dist) = check_floor(floor)
+    corridor = 0
+    for row in range(floor.height):
+        line = floor.base_row(row)
+        corridor += line.count('#') + line.count('+')
+    return { "seed": seed,
+             "time_ms": elapsed * 1000.0,
+             "room_attempts": stats["room_attempts"],
+             "connect_calls": stats["connect_calls"],
+             "restarts": stats["restarts"],
+             "rooms": len(floor.rooms),
+             "corridor": corridor,
+             "stair_dist": stair_dist,
+             "errors": errors }
+
+def percentile(values, p):
+    '''
+    nearest-rank percentile of a sorted list
+    '''
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values)-1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a corpus of "
+            "seeded floors and report generator statistics")
+    parser.add_argument("--floors", type=int, default=10000,
+            help="number of floors to generate (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the first floor; floors use consecutive seeds "
+                 "(default: %(default)s)")
+    parser.add_argument("--width", type=int, default=80,
+            help="floor width (default: %(default)s)")
+    parser.add_argument("--height", type=int, default=25,
+            help="floor height (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(),
+            help="worker processes (default: %(default)s)")
+    parser.add_argument("--out", default=None,
+            help="file to stream per-floor metrics to (JSON lines)")
+    args = parser.parse_args()
+
+    tasks = [ (seed, args.width, args.height)
+              for seed in range(args.seed, args.seed + args.floors) ]
+    values = { metric: [] for metric in METRICS }
+    failures = []
+    slowest = None
+    out = open(args.out, "w") if args.out else None
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.jobs)
+    for result in pool.imap_unordered(measure, tasks, chunksize=64):
+        if out:
+            out.write(json.dumps(result) + "\n")
+        if len(result["errors"]) > 0:
+            failures.append(result)
+        if "rooms" in result:
+            for metric in METRICS:
+                if result[metric] is not None:
+                    values[metric].append(result[metric])
+        if slowest is None or result["time_ms"] > slowest["time_ms"]:
+            slowest = result
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+    if out:
+        out.close()
+
+    print ("Generated " + str(args.floors) + " " + str(args.width) + "x" +
+           str(args.height) + " floors in %.1f seconds" % elapsed)
+    print ("  %-14s" % "METRIC" + "".join([ "%10s" % ("p" + str(p))
+           for p in PERCENTILES ]) + "%10s" % "max")
+    for metric in METRICS:
+        data = sorted(values[metric])
+        if len(data) == 0:
+            continue
+        print ("  %-14s" % metric + "".join([ "%10.2f" % percentile(data, p)
+               for p in PERCENTILES ]) + "%10.2f" % data[-1])
+    print ("Slowest seed: " + str(slowest["seed"]) +
+           " (%.2f ms)" % slowest["time_ms"])
+    if len(failures) > 0:
+        print (str(len(failures)) + " floor(s) violated invariants:")
+        for result in sorted(failures, key=lambda r: r["seed"])[:20]:
+            print ("  seed " + str(result["seed"]) + ": " +
+                   "; ".join(result["errors"]))
+        sys.exit(1)
+    print ("All invariants held.")
+
+if __name__ == "__main__":
+    main()
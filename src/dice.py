@@ -0,0 +1,133 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains the dice expressions used for damage rolls.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import fractions
+import random
+import re
+
+DICE_PATTERN = re.compile(r'^\s*(\d+)\s*d\s*(\d+)\s*(?:([+-])\s*(\d+))?\s*$')
+
+_parsed = {}            # spec string -> Dice
+_distributions = {}     # Dice -> exact distribution
+_numpy = []             # [ NumPy module or None ] once we've tried to import it
+
+def load_numpy():
+    '''
+    returns the NumPy module (or None if it isn't installed); NumPy is slow
+    to import, so this is put off until something actually needs it
+    '''
+    if len(_numpy) == 0:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+class Dice(collections.namedtuple('Dice', ['num', 'sides', 'mod'])):
+    '''
+    "dice" = immutable compiled dice expression: roll num dice with the given
+             number of sides each, add them up, and add mod (e.g., "2d6+1")
+    '''
+
+    __slots__ = ()
+
+    @staticmethod
+    def parse(spec):
+        '''
+        compile a dice expression like "2d6" or "1d4-1" (compiled expressions
+        are cached, so this is cheap to call repeatedly)
+        '''
+        dice = _parsed.get(spec)
+        if dice is None:
+            match = DICE_PATTERN.match(spec)
+            if match is None or int(match.group(1)) < 1 or int(match.group(2)) < 1:
+                raise ValueError("invalid dice expression: " + repr(spec))
+            mod = int(match.group(4) or 0)
+            if match.group(3) == '-':
+                mod = -mod
+            dice = Dice(int(match.group(1)), int(match.group(2)), mod)
+            _parsed[spec] = dice
+        return dice
+
+    def __str__(self):
+        spec = str(self.num) + "d" + str(self.sides)
+        if self.mod > 0:
+            spec += "+" + str(self.mod)
+        elif self.mod < 0:
+            spec += "-" + str(-self.mod)
+        return spec
+
+    def roll(self, rng=random):
+        '''
+        roll the dice once
+        '''
+        total = self.mod
+        for i in range(self.num):
+            total += rng.randint(1, self.sides)
+        return total
+
+    def roll_many(self, count, rng=None):
+        '''
+        roll the dice count times; returns a NumPy array if NumPy is available
+        (rng may then be a numpy.random.Generator) and a list otherwise
+        '''
+        numpy = load_numpy()
+        if numpy is None:
+            rng = rng or random
+            return [ self.roll(rng) for i in range(count) ]
+        if rng is None:
+            rng = numpy.random.default_rng(random.getrandbits(64))
+        rolls = rng.integers(1, self.sides + 1, size=(count, self.num))
+        return rolls.sum(axis=1) + self.mod
+
+    def min(self):
+        return self.num + self.mod
+
+    def max(self):
+        return self.num * self.sides + self.mod
+
+    def expected(self):
+        return fractions.Fraction(self.num * (self.sides + 1), 2) + self.mod
+
+    def distribution(self):
+        '''
+        returns the exact probability of every possible total as a dictionary
+        mapping totals to Fractions
+        '''
+        dist = _distributions.get(self)
+        if dist is None:
+            ways = { 0: 1 }
+            for i in range(self.num):
+                new_ways = collections.defaultdict(int)
+                for total, count in ways.items():
+                    for face in range(1, self.sides + 1):
+                        new_ways[total + face] += count
+                ways = new_ways
+            outcomes = self.sides ** self.num
+            dist = { total + self.mod: fractions.Fraction(count, outcomes)
+                     for total, count in sorted(ways.items()) }
+            _distributions[self] = dist
+        return dist
+
+    def probability_at_least(self, amount):
+        return sum([ p for total, p in self.distribution().items()
+                     if total >= amount ], fractions.Fraction(0))
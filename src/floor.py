@@ -18,8 +18,11 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import array
 import collections
+import copy
 import random
+import re
 
 from geom import Point, Rect
 
@@ -36,12 +39,49 @@ DEFAULT_ROOM_VERTICAL_BUFFER   = 5
 
 INVALID_ROOM = Rect(0,0,0,0)
 
+# floors are stored in square chunks of tiles; chunks that contain nothing but
+# empty space are never allocated
+CHUNK_SIZE = 32
+RANDOM_POINT_TRIES = 32     # random probes in random_point_in_room
+DARK_ROOM_CHANCE = 0.25     # chance that a room on a large floor is unlit
+ACTIVE_CHUNK_RADIUS = 2     # how far (in chunks) from the player NPCs act
+
+# large floors are laid out on a grid of cells with one room each; a cell's
+# room (and corridors to its neighbors) are only generated once the player
+# comes near it
+LAYOUT_CELL_WIDTH  = 32
+LAYOUT_CELL_HEIGHT = 16
+LAYOUT_CELL_MARGIN = 2
+
 VISION_BLOCKERS = { ' ', '+', '-', '|' }
 EXPLORABLES     = { ' ',      '-', '|', '#' }
+WALKABLES       = { '.', '#', '<', '>' }
+PASSABLES       = WALKABLES | { '+' }    # (doors can be opened on the way)
+ROOM_TILES      = { '.' }    # where things are placed (see random_point_in_room)
+
+ALL_DIRS = [ (-1, 0), (1, 0), (0, -1), (0, 1),
+             (-1,-1), (-1, 1), (1,-1), (1, 1) ]
+
+_mask_tables = {}   # translation tables (see mask_table)
+
+def mask_table(chars):
+    '''
+    returns a bytes.translate table that maps the given characters to '1' and
+    everything else to '0' (used to turn rows of tiles into bitsets)
+    '''
+    key = frozenset(chars)
+    table = _mask_tables.get(key)
+    if table is None:
+        table = bytes(ord('1') if chr(i) in key else ord('0')
+                      for i in range(256))
+        _mask_tables[key] = table
+    return table
 
 class Floor:
     '''
-    "floor" = 2d array of base characters implemented as a list of strings
+    "floor" = 2d array of base characters, stored as a dictionary of
+              CHUNK_SIZE x CHUNK_SIZE bytearrays indexed by (row, col) of the
+              chunk; tiles in unallocated chunks are empty space (' ')
     '''
 
     def __init__(self, width, height, up):
@@ -50,36 +90,349 @@ class Floor:
         self.up = up
         self.down = None
         self.rooms = []
-        self.base = []
-        self.explored = []
+        self.lit_rooms = set()  # indices (into rooms) of rooms that are lit
+        self.room_rows = [ None ] * height  # per-row room ids (see room_id_at)
+        self.chunks = {}
+        self.shared_chunks = set()  # chunks that forks also use (see fork)
+        self.explored = []      # per-row bitsets of tiles the player has seen
+        self.unexplorable = []  # per-row bitsets of tiles not in EXPLORABLES
         for row in range(height):
-            line = " " * width
-            self.base.append(line)
-            self.explored.append(line)
+            self.explored.append(0)
+            self.unexplorable.append(0)
+        self.dist_cache = {}    # cached BFS distance maps (see distance_map)
+        self.version = 0        # incremented whenever a tile changes
+        self.fov_algorithm = None   # overrides the game's (see Game.choose_fov_algorithm)
+        self.sim_turn = None    # turn the player last left it (see Game.catch_up_floor)
+
+        # every room tile, in a list for random picks and a dict to find a
+        # tile's place in the list (built when first needed; see
+        # random_point_in_room)
+        self.room_tiles = None
+        self.room_tile_index = None
+        self.room_tiles_shared = False      # (with a fork; copy before changing)
+
+        # lazily-generated layout (see generate_large_floor)
+        self.layout_seed = None
+        self.cell_rows = 0
+        self.cell_cols = 0
+        self.generated_cells = set()
+        self.pending = {}       # writes to cells that haven't been generated
+
+    @property
+    def __json_encode__(self):
+        # debugging dumps show the floor as a list of strings
+        data = dict(self.__dict__)
+        data['base'] = [self.base_row(row) for row in range(self.height)]
+        data['lit_rooms'] = sorted(self.lit_rooms)
+        for key in ['chunks', 'shared_chunks', 'dist_cache', 'generated_cells',
+                    'pending', 'room_tiles', 'room_tile_index', 'room_rows']:
+            del data[key]
+        return data
 
     def get_base(self, row, col):
-        return self.base[row][col] if self.is_inside(row, col) else '\0'
+        if not self.is_inside(row, col):
+            return '\0'
+        chunk = self.chunks.get((row // CHUNK_SIZE, col // CHUNK_SIZE))
+        if chunk is None:
+            return ' '
+        return chr(chunk[(row % CHUNK_SIZE) * CHUNK_SIZE + col % CHUNK_SIZE])
 
     def get_base_pt(self, pt):
         return self.get_base(pt.row, pt.col)
 
+    def base_row(self, row, left=0, right=None):
+        '''
+        returns the base characters of a row (or part of one) as a string
+        '''
+        if right is None:
+            right = self.width
+        crow = row // CHUNK_SIZE
+        offset = (row % CHUNK_SIZE) * CHUNK_SIZE
+        parts = []
+        col = left
+        while col < right:
+            ccol = col // CHUNK_SIZE
+            end = min(right, (ccol+1) * CHUNK_SIZE)
+            chunk = self.chunks.get((crow, ccol))
+            if chunk is None:
+                parts.append(' ' * (end-col))
+            else:
+                start = offset + col % CHUNK_SIZE
+                parts.append(chunk[start:start+end-col].decode('latin-1'))
+            col = end
+        return ''.join(parts)
+
     def base_blocks_vision(self, row, col):
-        return self.base[row][col] in VISION_BLOCKERS
+        return self.get_base(row, col) in VISION_BLOCKERS
 
     def set_base(self, row, col, char):
-        self.base[row] = self.base[row][:col] + char + self.base[row][col+1:]
+        cell = self.cell_at(row, col)
+        if cell is not None and cell not in self.generated_cells:
+            self.pending[(row, col)] = char
+        self.set_tile(row, col, char)
+
+    def set_tile(self, row, col, char):
+        key = (row // CHUNK_SIZE, col // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if char == ' ':
+                return
+            chunk = bytearray(b' ' * (CHUNK_SIZE * CHUNK_SIZE))
+            self.chunks[key] = chunk
+        elif key in self.shared_chunks:
+            chunk = self.own_chunk(key)
+        offset = (row % CHUNK_SIZE) * CHUNK_SIZE + col % CHUNK_SIZE
+        if (chr(chunk[offset]) in ROOM_TILES) != (char in ROOM_TILES):
+            self.update_room_tile(row, col, char in ROOM_TILES)
+        chunk[offset] = ord(char)
+        self.version += 1
+        if char in EXPLORABLES:
+            self.unexplorable[row] &= ~(1 << col)
+        else:
+            self.unexplorable[row] |= 1 << col
+        if self.dist_cache:
+            self.dist_cache = {}
+
+    def set_rows(self, top, rows, left=0):
+        '''
+        write a block of base characters starting at (top, left), given as
+        one bytes object per row; much faster than set_tile for big areas
+        (note that unlike set_base, this ignores any lazily-generated layout)
+        '''
+        for i in range(len(rows)):
+            row = top + i
+            line = rows[i]
+            if self.room_tiles is not None:
+                before = self.row_mask(row, ROOM_TILES, left, left + len(line))
+            crow = row // CHUNK_SIZE
+            offset = (row % CHUNK_SIZE) * CHUNK_SIZE
+            col = left
+            while col < left + len(line):
+                ccol = col // CHUNK_SIZE
+                end = min(left + len(line), (ccol+1) * CHUNK_SIZE)
+                part = line[col-left:end-left]
+                chunk = self.chunks.get((crow, ccol))
+                if chunk is None and part.strip(b' '):
+                    chunk = bytearray(b' ' * (CHUNK_SIZE * CHUNK_SIZE))
+                    self.chunks[(crow, ccol)] = chunk
+                elif (crow, ccol) in self.shared_chunks:
+                    chunk = self.own_chunk((crow, ccol))
+                if chunk is not None:
+                    start = offset + col % CHUNK_SIZE
+                    chunk[start:start+end-col] = part
+                col = end
+
+            # update which tiles in the row can't be remembered
+            span = ((1 << len(line)) - 1) << left
+            bits = line.translate(mask_table(EXPLORABLES))[::-1]
+            self.unexplorable[row] = (self.unexplorable[row] & ~span) | \
+                    ((~int(bits, 2) << left) & span)
+
+            # update the room tile index (if there is one yet)
+            if self.room_tiles is not None:
+                after = int(line.translate(mask_table(ROOM_TILES))[::-1], 2) << left
+                changed = before ^ after
+                while changed:
+                    bit = changed & -changed
+                    self.update_room_tile(row, bit.bit_length() - 1, after & bit != 0)
+                    changed ^= bit
+        self.version += 1
+        if self.dist_cache:
+            self.dist_cache = {}
+
+    def own_chunk(self, key):
+        '''
+        replace a chunk shared with a fork by a private copy before writing
+        to it
+        '''
+        chunk = bytearray(self.chunks[key])
+        self.chunks[key] = chunk
+        self.shared_chunks.discard(key)
+        return chunk
+
+    def fork(self):
+        '''
+        returns a copy of this floor that shares its tile chunks with this one
+        until either of them writes to a chunk (the per-row bitsets are
+        copied, but they are just lists of ints)
+        '''
+        child = copy.copy(self)
+        self.shared_chunks = set(self.chunks)
+        child.shared_chunks = set(self.chunks)
+        child.chunks = dict(self.chunks)
+        child.rooms = list(self.rooms)
+        child.lit_rooms = set(self.lit_rooms)
+        child.room_rows = list(self.room_rows)
+        child.explored = list(self.explored)
+        child.unexplorable = list(self.unexplorable)
+        child.dist_cache = dict(self.dist_cache)
+        child.generated_cells = set(self.generated_cells)
+        child.pending = dict(self.pending)
+        if self.room_tiles is not None:
+            self.room_tiles_shared = True
+            child.room_tiles_shared = True
+        return child
+
+    def update_room_tile(self, row, col, is_room):
+        '''
+        add a tile to the room tile index or remove it (a removed tile's
+        place in the list is taken by the last one, so both are O(1))
+        '''
+        if self.room_tiles is None:
+            return
+        if self.room_tiles_shared:
+            self.room_tiles = list(self.room_tiles)
+            self.room_tile_index = dict(self.room_tile_index)
+            self.room_tiles_shared = False
+        key = (row, col)
+        if is_room:
+            if key not in self.room_tile_index:
+                self.room_tile_index[key] = len(self.room_tiles)
+                self.room_tiles.append(key)
+        else:
+            i = self.room_tile_index.pop(key, None)
+            if i is not None:
+                last = self.room_tiles.pop()
+                if i < len(self.room_tiles):
+                    self.room_tiles[i] = last
+                    self.room_tile_index[last] = i
 
     def set_base_pt(self, pt, char):
         self.set_base(pt.row, pt.col, char)
 
     def explore(self, row, col):
-        if self.base[row][col] in EXPLORABLES:
-            self.explored[row] = self.explored[row][:col] + \
-                    self.base[row][col] + self.explored[row][col+1:]
+        self.explored[row] |= 1 << col
 
     def explore_pt(self, pt):
         self.explore(pt.row, pt.col)
 
+    def explore_rows(self, masks, top=0, bottom=None):
+        '''
+        merge a list of per-row visibility bitsets into the explored bitsets
+        (optionally only rows top through bottom-1)
+        '''
+        explored = self.explored
+        if bottom is None:
+            bottom = len(masks)
+        for row in range(top, bottom):
+            if masks[row] & ~explored[row]:
+                explored[row] |= masks[row]
+                if self.dist_cache:
+                    self.dist_cache = {}
+
+    def is_explored(self, row, col):
+        return (self.explored[row] >> col) & 1 == 1
+
+    def remembered_row(self, row):
+        '''
+        bitset of the tiles in a row that are drawn from memory (explored tiles
+        whose base character is in EXPLORABLES)
+        '''
+        return self.explored[row] & ~self.unexplorable[row]
+
+    def row_mask(self, row, chars, left=0, right=None):
+        '''
+        bitset of the tiles in a row (optionally only columns left through
+        right-1) whose base character is in the given set
+        '''
+        bits = self.base_row(row, left, right).encode('latin-1')
+        return int(bits.translate(mask_table(chars))[::-1], 2) << left
+
+    def frontier(self):
+        '''
+        returns the explored walkable tiles and doors that border unexplored
+        territory, as a list of (row, col) tuples (cached along with the
+        distance maps)
+        '''
+        goals = self.dist_cache.get('frontier')
+        if goals is not None:
+            return goals
+
+        # the field of view never reaches the last row or column (see
+        # Game.update_visibility), so unexplored tiles there don't count
+        goals = []
+        for row in range(self.height):
+            explored = self.explored[row]
+            if explored == 0:
+                continue
+
+            # only look at the columns around the explored part of the row
+            left = max((explored & -explored).bit_length() - 2, 0)
+            right = min(explored.bit_length() + 1, self.width - 1)
+            span = ((1 << (right - left)) - 1) << left
+            near = 0
+            for r in range(max(row-1, 0), min(row+2, self.height - 1)):
+                unexplored = ~self.explored[r] & span
+                near |= unexplored | (unexplored << 1) | (unexplored >> 1)
+            mask = explored & near
+            if mask:
+                mask &= self.row_mask(row, PASSABLES, left, right)
+            while mask:
+                low = mask & -mask
+                goals.append((row, low.bit_length() - 1))
+                mask ^= low
+
+        self.dist_cache['frontier'] = goals
+        return goals
+
+    def distance_map(self, goals):
+        '''
+        breadth-first search outward from the given (row, col) goals across
+        explored walkable tiles and doors (which travel opens); returns a dict mapping each reachable tile to
+        its distance (in moves) from the closest goal
+
+        maps are cached until a tile changes or more of the floor is explored
+        '''
+        key = frozenset(goals)
+        dist = self.dist_cache.get(key)
+        if dist is not None:
+            return dist
+
+        dist = {}
+        workqueue = collections.deque()
+        for goal in key:
+            dist[goal] = 0
+            workqueue.append(goal)
+        while len(workqueue) > 0:
+            (row, col) = workqueue.popleft()
+            d = dist[(row, col)] + 1
+            for (dr, dc) in ALL_DIRS:
+                pt = (row+dr, col+dc)
+                if pt not in dist and \
+                        self.get_base(pt[0], pt[1]) in PASSABLES and \
+                        self.is_explored(pt[0], pt[1]):
+                    dist[pt] = d
+                    workqueue.append(pt)
+
+        self.dist_cache[key] = dist
+        return dist
+
+    def masked_row(self, row, mask, left=0, right=None):
+        '''
+        returns a row (or part of one, starting at column left) of base
+        characters with every tile not in the given bitset blanked out; bit 0
+        of the mask corresponds to column left
+        '''
+        if right is None:
+            right = self.width
+        width = right - left
+        mask &= (1 << width) - 1
+        if mask == 0:
+            return ' ' * width
+        line = self.base_row(row, left, right)
+        if mask == (1 << width) - 1:
+            return line
+        bits = format(mask, 'b').zfill(width)[::-1]
+        return ''.join([c if b == '1' else ' ' for c, b in zip(line, bits)])
+
+    def is_near(self, pt1, pt2, radius=ACTIVE_CHUNK_RADIUS):
+        '''
+        determine whether two points are within the given number of chunks of
+        each other
+        '''
+        return abs(pt1.row // CHUNK_SIZE - pt2.row // CHUNK_SIZE) <= radius and \
+               abs(pt1.col // CHUNK_SIZE - pt2.col // CHUNK_SIZE) <= radius
+
     def is_inside(self, row, col):
         return (row >= 0 and row < self.height and
                 col >= 0 and col < self.width)
@@ -94,13 +447,13 @@ class Floor:
         valid = self.is_rect_inside(rect)
         if valid:
             for row in range(rect.top, rect.bottom):
-                for col in range(rect.left, rect.right):
-                    if self.base[row][col] != ' ':
-                        valid = False
+                if self.base_row(row, rect.left, rect.right).strip(' '):
+                    valid = False
+                    break
         return valid
 
-    def add_room(self, room):
-        self.rooms.append(room)
+    def add_room(self, room, lit=True):
+        self.register_room(room, lit)
         [left, right, top, bottom] = room.bounds()
         for row in range(top, bottom):
             for col in range(left, right):
@@ -111,26 +464,119 @@ class Floor:
                 else:
                     self.set_base(row, col, '.')
 
+    def register_room(self, room, lit=True):
+        '''
+        add a room to the room list and the room-id grid without drawing it
+        (rooms don't overlap; their walls and the doors in them count as
+        part of the room, corridors don't)
+        '''
+        self.rooms.append(room)
+        if lit:
+            self.lit_rooms.add(len(self.rooms) - 1)
+        (left, right) = (max(room.left, 0), min(room.right, self.width))
+        ids = array.array('H', [ len(self.rooms) ]) * (right - left)
+        for row in range(max(room.top, 0), min(room.bottom, self.height)):
+            # rows are replaced rather than changed so that forks can share them
+            if self.room_rows[row] is None:
+                line = array.array('H', bytes(2 * self.width))
+            else:
+                line = array.array('H', self.room_rows[row])
+            line[left:right] = ids
+            self.room_rows[row] = line
+
+    def room_id_at(self, row, col):
+        '''
+        returns the index (into rooms) of the room containing a tile, or None
+        if it isn't part of a room
+        '''
+        if not self.is_inside(row, col):
+            return None
+        line = self.room_rows[row]
+        if line is None or line[col] == 0:
+            return None
+        return line[col] - 1
+
+    def room_at(self, pt):
+        '''
+        returns the room containing a point, or None if it isn't in one
+        '''
+        i = self.room_id_at(pt.row, pt.col)
+        return None if i is None else self.rooms[i]
+
+    def is_lit(self, i):
+        return i in self.lit_rooms
+
+    def room_mask(self, i):
+        '''
+        returns the rows a room spans and the bitset of its columns, e.g. for
+        revealing a whole lit room at once
+        '''
+        room = self.rooms[i]
+        return (room.top, room.bottom,
+                ((1 << room.right) - 1) ^ ((1 << room.left) - 1))
+
     def random_point(self, vbuffer=0, hbuffer=0):
         row = random.randrange(vbuffer, self.height-vbuffer)
         col = random.randrange(hbuffer, self.width-hbuffer)
         return Point(row,col)
 
     def random_point_in_room(self, vbuffer=0, hbuffer=0):
-        pt = self.random_point(vbuffer, hbuffer)
-        while not self.is_in_room(pt.row, pt.col):
-            pt = self.random_point(vbuffer, hbuffer)
-        return pt
+        '''
+        returns a random room tile at least vbuffer rows and hbuffer columns
+        from the edges of the floor; raises ValueError if there isn't one
+        '''
+        if self.layout_seed is not None:
+            return self.random_point_in_layout(vbuffer, hbuffer)
+        if self.room_tiles is None:
+            # on floors that are mostly rooms (e.g., caves) random probing
+            # finds one quickly; the index is only built once that fails
+            if 2*vbuffer < self.height and 2*hbuffer < self.width:
+                for i in range(RANDOM_POINT_TRIES):
+                    pt = self.random_point(vbuffer, hbuffer)
+                    if self.is_in_room(pt.row, pt.col):
+                        return pt
+            self.room_tiles = [ (row, match.start())
+                                for row in range(self.height)
+                                for match in re.finditer(r'\.', self.base_row(row)) ]
+            self.room_tile_index = dict(zip(self.room_tiles,
+                                            range(len(self.room_tiles))))
+        tiles = self.room_tiles
+        if len(tiles) == 0:
+            raise ValueError("no room tiles on this floor")
+
+        def inside(tile):
+            return tile[0] >= vbuffer and tile[0] < self.height - vbuffer and \
+                   tile[1] >= hbuffer and tile[1] < self.width - hbuffer
+
+        # usually most tiles are far enough from the edges; if not, pick from
+        # the ones that are
+        for i in range(RANDOM_POINT_TRIES):
+            tile = tiles[random.randrange(len(tiles))]
+            if inside(tile):
+                return Point(*tile)
+        tiles = [ tile for tile in tiles if inside(tile) ]
+        if len(tiles) == 0:
+            raise ValueError("no room tiles at least " + str(vbuffer) +
+                    " rows and " + str(hbuffer) + " columns from the edges")
+        return Point(*random.choice(tiles))
 
     def is_in_room(self, row, col):
-        return self.is_inside(row, col) and self.base[row][col] == '.'
+        return self.get_base(row, col) == '.'
+
+    def random_point_in_rect(self, room):
+        '''
+        returns a random point in the interior of a room (inside its walls)
+        '''
+        return Point(random.randrange(room.top+1, room.bottom-1),
+                     random.randrange(room.left+1, room.right-1))
 
     def generate_door (self, default='#'):
         return '+' if random.random() < 0.33 else default
 
-    def generate_room(self, center=None):
+    def generate_room(self, center=None, stats=None):
         '''
-        generate random locations until a valid room is found
+        generate random locations until a valid room is found; if a stats
+        dictionary is given, the number of locations tried is added to it
         '''
         count = 0
         valid = False
@@ -162,17 +608,21 @@ class Floor:
             # stop looking if we've looked too long
             count = count + 1
             if not valid and count > 500:
-                return INVALID_ROOM
+                break
 
-        return room
+        if stats is not None:
+            stats["room_attempts"] += count
+        return room if valid else INVALID_ROOM
 
-    def connect_rooms (self, room1, room2, permissive=False, tries=5):
+    def connect_rooms (self, room1, room2, permissive=False, tries=5, stats=None):
         '''
         generates a connecting straight path between two rooms if one is
         possible without overwriting any other paths or rooms; in permissive
         mode the path is allowed to overwrite/intersect with other paths;
         returns true if the rooms could be connected and false otherwise
         '''
+        if stats is not None:
+            stats["connect_calls"] += 1
         room1.shrink()
         room2.shrink()
         [l1, r1, t1, b1] = room1.bounds()
@@ -195,16 +645,16 @@ class Floor:
                     row = random.randrange(top,bot)
                     valid = True
                     for col in range(left,right):
-                        if not (self.base[row][col] == ' ' or
-                                self.base[row][col] == '|' or
-                                (permissive and self.base[row][col] == '#')):
+                        if not (self.get_base(row, col) == ' ' or
+                                self.get_base(row, col) == '|' or
+                                (permissive and self.get_base(row, col) == '#')):
                             valid = False
                     if valid:
                         path_created = True
                         for col in range(left,right):
-                            if self.base[row][col] == ' ':
+                            if self.get_base(row, col) == ' ':
                                 self.set_base(row, col, '#')
-                            elif self.base[row][col] == '|':
+                            elif self.get_base(row, col) == '|':
                                 self.set_base(row, col, self.generate_door())
 
             # vertical path
@@ -217,24 +667,47 @@ class Floor:
                     col = random.randrange(left,right)
                     valid = True
                     for row in range(top,bot):
-                        if not (self.base[row][col] == ' ' or
-                                self.base[row][col] == '-' or
-                                (permissive and self.base[row][col] == '#')):
+                        if not (self.get_base(row, col) == ' ' or
+                                self.get_base(row, col) == '-' or
+                                (permissive and self.get_base(row, col) == '#')):
                             valid = False
                     if valid:
                         path_created = True
                         for row in range(top,bot):
-                            if self.base[row][col] == ' ':
+                            if self.get_base(row, col) == ' ':
                                 self.set_base(row, col, '#')
-                            elif self.base[row][col] == '-':
+                            elif self.get_base(row, col) == '-':
                                 self.set_base(row, col, self.generate_door())
         return path_created
 
     @staticmethod
-    def generate_basic_floor (width, height, up=None, debug=False):
+    def fits_upstairs(width, height, large, rows, cols):
+        '''
+        whether a room floor can be generated with its upstairs at the given
+        tiles (numbers or NumPy arrays of them): far enough from the edges for
+        the first room of a basic floor, or on large floors where cell_room
+        can fit a room around them
+        '''
+        if not large:
+            return (rows >= DEFAULT_ROOM_VERTICAL_BUFFER) & \
+                   (rows < height - DEFAULT_ROOM_VERTICAL_BUFFER) & \
+                   (cols >= DEFAULT_ROOM_HORIZONTAL_BUFFER) & \
+                   (cols < width - DEFAULT_ROOM_HORIZONTAL_BUFFER)
+        row = rows % LAYOUT_CELL_HEIGHT
+        col = cols % LAYOUT_CELL_WIDTH
+        return (rows // LAYOUT_CELL_HEIGHT < height // LAYOUT_CELL_HEIGHT) & \
+               (cols // LAYOUT_CELL_WIDTH < width // LAYOUT_CELL_WIDTH) & \
+               (row > LAYOUT_CELL_MARGIN) & \
+               (row < LAYOUT_CELL_HEIGHT - LAYOUT_CELL_MARGIN - 1) & \
+               (col > LAYOUT_CELL_MARGIN) & \
+               (col < LAYOUT_CELL_WIDTH - LAYOUT_CELL_MARGIN - 1)
+
+    @staticmethod
+    def generate_basic_floor (width, height, up=None, debug=False, stats=None):
         '''
         generate a floor with some rooms and paths between them; all rooms are
-        guaranteed to be reachable
+        guaranteed to be reachable; if a stats dictionary is given (e.g., a
+        collections.Counter), counts of the generator's work are added to it
         '''
         floor = Floor(width, height, up)
 
@@ -244,16 +717,16 @@ class Floor:
                     DEFAULT_ROOM_HORIZONTAL_BUFFER)
 
         # generate first room
-        room = floor.generate_room(floor.up)
+        room = floor.generate_room(floor.up, stats)
         if room == INVALID_ROOM:
-            raise "Cannot generate first room!"
+            raise RuntimeError("Cannot generate first room!")
         floor.add_room(room)
         floor.set_base_pt(floor.up, '<')
 
         # generate other rooms
         for r in range(random.randrange(DEFAULT_ROOM_NUM_LLIMIT,
                                         DEFAULT_ROOM_NUM_ULIMIT)):
-            room = floor.generate_room()
+            room = floor.generate_room(stats=stats)
             if not room == INVALID_ROOM:
                 floor.add_room(room)
 
@@ -274,7 +747,7 @@ class Floor:
             for r2 in range(len(floor.rooms)):
                 if r2 not in connected:
                     if floor.connect_rooms(floor.rooms[r1],
-                                           floor.rooms[r2], False, 5):
+                                           floor.rooms[r2], False, 5, stats):
                         adjacent[r1].add(r2)
                         adjacent[r2].add(r1)
                         connected.add(r2)
@@ -291,7 +764,7 @@ class Floor:
                         if debug:
                             print ("2nd pass: connecting " + str(r1) + " to " + str(r2))
                         if floor.connect_rooms(floor.rooms[r1],
-                                               floor.rooms[r2], True, 10):
+                                               floor.rooms[r2], True, 10, stats):
                             adjacent[r1].add(r2)
                             adjacent[r2].add(r1)
                             connected.add(r1)
@@ -303,7 +776,7 @@ class Floor:
             r2 = random.randrange(len(floor.rooms))
             if r1 != r2 and r1 not in adjacent[r2]:
                 if floor.connect_rooms(floor.rooms[r1],
-                                       floor.rooms[r2], False, 1):
+                                       floor.rooms[r2], False, 1, stats):
                     adjacent[r1].add(r2)
                     adjacent[r2].add(r1)
 
@@ -317,11 +790,190 @@ class Floor:
             return floor
         else:
             # this level is potentially impossible -- need to start over
-            return Floor.generate_basic_floor(width, height, up, debug)
+            if stats is not None:
+                stats["restarts"] += 1
+            return Floor.generate_basic_floor(width, height, up, debug, stats)
+
+    def cell_at(self, row, col):
+        '''
+        returns the layout cell containing a tile, or None if this floor does
+        not have a lazily-generated layout
+        '''
+        if self.layout_seed is None:
+            return None
+        cell = (row // LAYOUT_CELL_HEIGHT, col // LAYOUT_CELL_WIDTH)
+        if cell[0] >= self.cell_rows or cell[1] >= self.cell_cols:
+            return None
+        return cell
+
+    def cell_rng(self, kind, ci, cj):
+        '''
+        returns a random number generator that depends only on this floor's
+        layout seed and the given cell, so that any part of the layout can be
+        recomputed without generating the rest of it
+        '''
+        return random.Random(((self.layout_seed * 7 + kind) * 100003 + ci)
+                             * 100003 + cj)
+
+    def cell_room(self, ci, cj):
+        '''
+        returns the room in a layout cell (the room always contains the
+        upstairs if they fall in this cell)
+        '''
+        rng = self.cell_rng(0, ci, cj)
+        top  = ci * LAYOUT_CELL_HEIGHT + LAYOUT_CELL_MARGIN
+        left = cj * LAYOUT_CELL_WIDTH  + LAYOUT_CELL_MARGIN
+        max_height = LAYOUT_CELL_HEIGHT - 2 * LAYOUT_CELL_MARGIN
+        max_width  = LAYOUT_CELL_WIDTH  - 2 * LAYOUT_CELL_MARGIN
+        height = rng.randrange(DEFAULT_ROOM_HEIGHT_MIN,
+                min(DEFAULT_ROOM_HEIGHT_MAX, max_height) + 1, 2)
+        width = rng.randrange(DEFAULT_ROOM_WIDTH_MIN,
+                min(DEFAULT_ROOM_WIDTH_MAX, max_width) + 1, 2)
+        if self.up is not None and self.cell_at(self.up.row, self.up.col) == (ci, cj):
+            row = rng.randint(max(top, self.up.row - height + 2),
+                              min(top + max_height - height, self.up.row - 1))
+            col = rng.randint(max(left, self.up.col - width + 2),
+                              min(left + max_width - width, self.up.col - 1))
+        else:
+            row = top  + rng.randrange(max_height - height + 1)
+            col = left + rng.randrange(max_width  - width  + 1)
+        return Rect(col, col + width, row, row + height)
+
+    def carve_connection(self, ci, cj, horizontal):
+        '''
+        carve the corridor between the room in a cell and the room in the cell
+        to its right (or below it); corridors only replace empty space, and
+        doors are only placed in walls (or where walls will be)
+        '''
+        room1 = self.cell_room(ci, cj)
+        rng = self.cell_rng(1 if horizontal else 2, ci, cj)
+        path = []
+        if horizontal:
+            room2 = self.cell_room(ci, cj+1)
+            row1 = rng.randrange(room1.top+1, room1.bottom-1)
+            row2 = rng.randrange(room2.top+1, room2.bottom-1)
+            mid = rng.randrange(room1.right, room2.left)
+            path += [ (row1, col) for col in range(room1.right, mid+1) ]
+            path += [ (row, mid)  for row in range(min(row1,row2), max(row1,row2)+1) ]
+            path += [ (row2, col) for col in range(mid, room2.left) ]
+            doors = [ (row1, room1.right-1), (row2, room2.left) ]
+        else:
+            room2 = self.cell_room(ci+1, cj)
+            col1 = rng.randrange(room1.left+1, room1.right-1)
+            col2 = rng.randrange(room2.left+1, room2.right-1)
+            mid = rng.randrange(room1.bottom, room2.top)
+            path += [ (row, col1) for row in range(room1.bottom, mid+1) ]
+            path += [ (mid, col)  for col in range(min(col1,col2), max(col1,col2)+1) ]
+            path += [ (row, col2) for row in range(mid, room2.top) ]
+            doors = [ (room1.bottom-1, col1), (room2.top, col2) ]
+        for (row, col) in path:
+            if self.get_base(row, col) == ' ':
+                self.set_tile(row, col, '#')
+        for (row, col) in doors:
+            char = '+' if rng.random() < 0.33 else '#'
+            if self.get_base(row, col) in [ ' ', '|', '-' ]:
+                self.set_tile(row, col, char)
+
+    def generate_cell(self, ci, cj):
+        '''
+        generate the room in a layout cell along with the corridors to its
+        neighbors; returns the new room
+        '''
+        self.generated_cells.add((ci, cj))
+        room = self.cell_room(ci, cj)
+        self.add_room(room, self.cell_rng(3, ci, cj).random() >= DARK_ROOM_CHANCE)
+        if cj > 0:
+            self.carve_connection(ci, cj-1, True)
+        if cj < self.cell_cols-1:
+            self.carve_connection(ci, cj, True)
+        if ci > 0:
+            self.carve_connection(ci-1, cj, False)
+        if ci < self.cell_rows-1:
+            self.carve_connection(ci, cj, False)
+
+        # apply any changes made to this cell before it was generated
+        for (row, col), char in list(self.pending.items()):
+            if self.cell_at(row, col) == (ci, cj):
+                self.set_tile(row, col, char)
+                del self.pending[(row, col)]
+        return room
+
+    def generate_near(self, pt, radius):
+        '''
+        generate every layout cell within the given distance of a point;
+        returns the list of newly-generated rooms
+        '''
+        rooms = []
+        if self.layout_seed is None:
+            return rooms
+        for ci in range(max(0, (pt.row - radius) // LAYOUT_CELL_HEIGHT),
+                min(self.cell_rows, (pt.row + radius) // LAYOUT_CELL_HEIGHT + 1)):
+            for cj in range(max(0, (pt.col - radius) // LAYOUT_CELL_WIDTH),
+                    min(self.cell_cols, (pt.col + radius) // LAYOUT_CELL_WIDTH + 1)):
+                if (ci, cj) not in self.generated_cells:
+                    rooms.append(self.generate_cell(ci, cj))
+        return rooms
+
+    def random_point_in_layout(self, vbuffer=0, hbuffer=0):
+        '''
+        returns a random point inside the room of a random layout cell (the
+        cell does not need to have been generated yet) at least vbuffer rows
+        and hbuffer columns from the edges of the floor; raises ValueError if
+        no room reaches that far in
+        '''
+        def inside(ci, cj):
+            # the part of the cell's room interior that is far enough in
+            room = self.cell_room(ci, cj)
+            return (max(room.top + 1, vbuffer),
+                    min(room.bottom - 1, self.height - vbuffer),
+                    max(room.left + 1, hbuffer),
+                    min(room.right - 1, self.width - hbuffer))
+
+        # usually a random cell will do; if not, pick from the ones that do
+        for i in range(RANDOM_POINT_TRIES):
+            (top, bottom, left, right) = inside(
+                    random.randrange(self.cell_rows),
+                    random.randrange(self.cell_cols))
+            if top < bottom and left < right:
+                return Point(random.randrange(top, bottom),
+                             random.randrange(left, right))
+        areas = [ inside(ci, cj) for ci in range(self.cell_rows)
+                                 for cj in range(self.cell_cols) ]
+        areas = [ (top, bottom, left, right)
+                  for (top, bottom, left, right) in areas
+                  if top < bottom and left < right ]
+        if len(areas) == 0:
+            raise ValueError("no room tiles at least " + str(vbuffer) +
+                    " rows and " + str(hbuffer) + " columns from the edges")
+        (top, bottom, left, right) = random.choice(areas)
+        return Point(random.randrange(top, bottom),
+                     random.randrange(left, right))
+
+    @staticmethod
+    def generate_large_floor (width, height, up=None):
+        '''
+        generate a floor on a grid of cells with one room per cell and
+        corridors between neighboring rooms; all rooms are reachable, and no
+        cell is actually generated until generate_near is called for it
+        '''
+        floor = Floor(width, height, up)
+        floor.layout_seed = random.getrandbits(32)
+        floor.cell_rows = height // LAYOUT_CELL_HEIGHT
+        floor.cell_cols = width  // LAYOUT_CELL_WIDTH
+
+        if up == None:
+            floor.up = floor.random_point_in_layout()
+        floor.set_base_pt(floor.up, '<')
+
+        floor.down = floor.random_point_in_layout()
+        while floor.down == floor.up:
+            floor.down = floor.random_point_in_layout()
+        floor.set_base_pt(floor.down, '>')
+        return floor
 
 
 if __name__ == "__main__":
     f = Floor.generate_basic_floor(80,25,None,True)
-    for line in f.base:     # print floor (base only)
-        print (line)
+    for row in range(f.height):     # print floor (base only)
+        print (f.base_row(row))
 
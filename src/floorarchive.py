@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    Archive of pre-generated floors. The build command generates (and checks)
+    floors offline for every spot where a downstairs can end up, and writes
+    them to a single file of fixed-size records grouped by upstairs position:
+
+        python src/floorarchive.py --out floors.dat --per-position 8 --jobs 4
+
+    A game started with --floor-archive floors.dat then memory-maps the file
+    and takes each new floor from it (one whose upstairs lines up with the
+    previous floor's downstairs) instead of generating it, falling back to
+    the live generator when there's no match.
+
+    File layout (all integers little-endian):
+        header:   magic, version, width, height, record count, index count
+        index:    (up row, up col, first record, record count) per position
+        records:  up row, up col, down row, down col, room count,
+                  ROOM_SLOTS x (left, right, top, bottom), width*height tiles
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import random
+import struct
+import time
+
+from floor import Floor, DEFAULT_ROOM_NUM_ULIMIT
+from geom import Point, Rect
+
+MAGIC   = b'HXFLOORS'
+VERSION = 1
+HEADER  = struct.Struct('<8sIHHII')
+INDEX   = struct.Struct('<HHII')
+RECORD  = struct.Struct('<HHHHB')
+ROOM    = struct.Struct('<HHHH')
+ROOM_SLOTS = DEFAULT_ROOM_NUM_ULIMIT
+
+DOWN_BUFFER = 6     # downstairs are placed at least this far from the edges
+
+_archives = {}      # open archives by path (see open_archive)
+
+class FloorArchive:
+    '''
+    A memory-mapped floor archive. Only the index is read up front; a
+    floor's record is only read from the mapping when the floor is drawn.
+    '''
+
+    def __init__(self, path):
+        f = open(path, "rb")
+        self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        (magic, version, self.width, self.height, self.count, positions) = \
+                HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a floor archive")
+        self.record_size = RECORD.size + ROOM_SLOTS * ROOM.size + \
+                self.width * self.height
+        self.index = {}         # (up row, up col) -> (first record, count)
+        for i in range(positions):
+            (row, col, first, count) = INDEX.unpack_from(self.data,
+                    HEADER.size + i * INDEX.size)
+            self.index[(row, col)] = (first, count)
+        self.records = HEADER.size + positions * INDEX.size
+
+    def draw(self, width, height, up=None):
+        '''
+        returns a random archived floor of the given size whose upstairs is
+        at the given point (any floor if up is None), or None if there isn't
+        one
+        '''
+        if width != self.width or height != self.height or self.count == 0:
+            return None
+        if up is None:
+            return self.read(random.randrange(self.count))
+        (first, count) = self.index.get((up.row, up.col), (0, 0))
+        if count == 0:
+            return None
+        return self.read(first + random.randrange(count))
+
+    def read(self, i):
+        '''
+        returns a new floor built from record i; the tiles are copied into the
+        floor's chunks, since records store whole rows and chunks are square,
+        and floors have to own their tiles to be written to, saved, and
+        swapped out (a default-size floor is 2 KB of tiles)
+        '''
+        offset = self.records + i * self.record_size
+        (up_row, up_col, down_row, down_col, num_rooms) = \
+                RECORD.unpack_from(self.data, offset)
+        floor = Floor(self.width, self.height, Point(up_row, up_col))
+        floor.down = Point(down_row, down_col)
+        offset += RECORD.size
+        for r in range(num_rooms):
+            floor.register_room(Rect(*ROOM.unpack_from(self.data,
+                                                       offset + r * ROOM.size)))
+        offset += ROOM_SLOTS * ROOM.size
+        floor.set_rows(0, [ self.data[offset + row * self.width:
+                                      offset + (row+1) * self.width]
+                            for row in range(self.height) ])
+        return floor
+
+def open_archive(path):
+    '''
+    returns the archive at the given path (opened once per process), or None
+    if it can't be read
+    '''
+    if path not in _archives:
+        try:
+            _archives[path] = FloorArchive(path)
+        except (OSError, ValueError):
+            _archives[path] = None
+    return _archives[path]
+
+def generate(args):
+    '''
+    worker entry point: generate and check one floor with the given
+    upstairs; returns its record, or None if it isn't valid
+    '''
+    from corpus import check_floor
+    (seed, width, height, row, col) = args
+    random.seed(seed)
+    try:
+        floor = Floor.generate_basic_floor(width, height, Point(row, col))
+    except Exception:           # includes RecursionError from runaway restarts
+        return None
+    (errors, stair_dist) = check_floor(floor)
+    if len(errors) > 0 or len(floor.rooms) > ROOM_SLOTS:
+        return None
+    rooms = b''.join([ ROOM.pack(*room.bounds()) for room in floor.rooms ])
+    rooms += b'\0' * ((ROOM_SLOTS - len(floor.rooms)) * ROOM.size)
+    tiles = b''.join([ floor.base_row(r).encode('latin-1')
+                       for r in range(height) ])
+    return RECORD.pack(row, col, floor.down.row, floor.down.col,
+                       len(floor.rooms)) + rooms + tiles
+
+def build(path, width, height, per_position, jobs, seed):
+    '''
+    generate per_position floors for every upstairs position that a
+    downstairs can be placed at, and write them to an archive
+    '''
+    positions = [ (row, col)
+                  for row in range(DOWN_BUFFER, height - DOWN_BUFFER)
+                  for col in range(DOWN_BUFFER, width - DOWN_BUFFER) ]
+    tasks = [ (seed + i, width, height) + positions[i // per_position]
+              for i in range(len(positions) * per_position) ]
+    groups = { pos: [] for pos in positions }
+    pool = multiprocessing.Pool(jobs)
+    for record in pool.imap(generate, tasks, chunksize=64):
+        if record is not None:
+            groups[RECORD.unpack_from(record)[:2]].append(record)
+    pool.close()
+    pool.join()
+
+    index = []
+    records = []
+    for pos in positions:
+        if len(groups[pos]) > 0:
+            index.append(INDEX.pack(pos[0], pos[1], len(records), len(groups[pos])))
+            records.extend(groups[pos])
+    f = open(path, "wb")
+    f.write(HEADER.pack(MAGIC, VERSION, width, height, len(records), len(index)))
+    f.write(b''.join(index))
+    f.write(b''.join(records))
+    f.close()
+    return (len(records), len(tasks), len(index))
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate an archive "
+            "of floors for new games to draw from")
+    parser.add_argument("--out", default="floors.dat",
+            help="archive file to write (default: %(default)s)")
+    parser.add_argument("--per-position", type=int, default=4,
+            help="floors per upstairs position (default: %(default)s)")
+    parser.add_argument("--width", type=int, default=80,
+            help="floor width (default: %(default)s)")
+    parser.add_argument("--height", type=int, default=25,
+            help="floor height (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(),
+            help="worker processes (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed of the first floor; floors use consecutive seeds "
+                 "(default: %(default)s)")
+    args = parser.parse_args()
+
+    start = time.time()
+    (count, attempts, positions) = build(args.out, args.width, args.height,
+            args.per_position, args.jobs, args.seed)
+    print ("Archived " + str(count) + " of " + str(attempts) + " floors (" +
+           str(positions) + " upstairs positions) to " + args.out +
+           " in %.1f seconds" % (time.time() - start))
+
+if __name__ == "__main__":
+    main()
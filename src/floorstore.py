@@ -0,0 +1,164 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains the container that holds the floors of a dungeon,
+    swapping floors that haven't been visited recently out to disk.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+SWAP_DIRNAME = ".floors"
+
+class FloorStore:
+    '''
+    List-like container of floors. If a resident limit is given, only that
+    many of the most recently used floors are kept in memory; the rest are
+    evicted (along with anything else the caller wants to keep with them) to
+    compressed files in a private swap directory and must be explicitly
+    loaded again before they are used.
+    '''
+
+    def __init__(self, resident=None):
+        self.floors = []        # Floor objects (None if evicted)
+        self.resident = resident
+        self.recent = []        # resident floor numbers, most recent last
+        self.swap_dir = None
+        self.swaps = {}         # floor number -> its swap file
+        self.evictions = 0      # (numbers the swap files)
+        self.lent = set()       # swap files that forks may still read
+        self.borrowed = {}      # floor number -> another store's swap file
+
+    def __setstate__(self, state):
+        if "swaps" not in state:
+            # (saved before swap files were numbered)
+            state["swaps"] = dict((f, os.path.join(state["swap_dir"],
+                                                   "floor" + str(f)))
+                                  for f in range(len(state["floors"]))
+                                  if state["floors"][f] is None and
+                                     f not in state["borrowed"])
+            state["evictions"] = 0
+            state["lent"] = set()
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.floors)
+
+    def __getitem__(self, f):
+        floor = self.floors[f]
+        if floor is None:
+            raise LookupError("floor " + str(f) + " is not resident")
+        return floor
+
+    def append(self, floor):
+        self.floors.append(floor)
+        self.touch(len(self.floors)-1)
+
+    def is_resident(self, f):
+        return self.floors[f] is not None
+
+    def touch(self, f):
+        '''
+        mark a floor as the most recently used one
+        '''
+        if f in self.recent:
+            self.recent.remove(f)
+        self.recent.append(f)
+
+    def victims(self):
+        '''
+        returns the floors that should be evicted to stay within the resident
+        limit (least recently used first)
+        '''
+        if self.resident is None:
+            return []
+        return self.recent[:max(len(self.recent) - self.resident, 0)]
+
+    def swap_path(self, f):
+        '''
+        returns a new swap file name for a floor (every eviction gets its own,
+        so that a file lent to a fork is never overwritten)
+        '''
+        self.evictions += 1
+        return os.path.join(self.swap_dir,
+                            "floor" + str(f) + "." + str(self.evictions))
+
+    def evict(self, f, extra=None):
+        '''
+        write a floor (and any extra data that goes with it) to disk and drop
+        it from memory
+        '''
+        if self.swap_dir is None:
+            os.makedirs(SWAP_DIRNAME, exist_ok=True)
+            self.swap_dir = tempfile.mkdtemp(dir=SWAP_DIRNAME)
+        data = pickle.dumps((self.floors[f], extra), pickle.HIGHEST_PROTOCOL)
+        self.swaps[f] = self.swap_path(f)
+        f_out = open(self.swaps[f], "wb")
+        f_out.write(zlib.compress(data))
+        f_out.close()
+        self.floors[f] = None
+        self.recent.remove(f)
+
+    def load(self, f):
+        '''
+        read an evicted floor back into memory; returns the extra data that
+        was evicted with it
+        '''
+        if f in self.borrowed:
+            f_in = open(self.borrowed.pop(f), "rb")
+            (floor, extra) = pickle.loads(zlib.decompress(f_in.read()))
+            f_in.close()
+        else:
+            path = self.swaps.pop(f)
+            f_in = open(path, "rb")
+            (floor, extra) = pickle.loads(zlib.decompress(f_in.read()))
+            f_in.close()
+            if path not in self.lent:
+                os.remove(path)     # (lent files stay until close)
+        self.floors[f] = floor
+        self.touch(f)
+        return extra
+
+    def fork(self):
+        '''
+        returns a copy of this store whose floors share their tiles with
+        these (see Floor.fork); the copy never evicts floors, and reads the
+        ones that are swapped out from this store's files, which are kept
+        until this store is closed even if it loads those floors itself (so
+        the copy should not outlive this store)
+        '''
+        child = FloorStore()
+        child.floors = [ floor.fork() if floor is not None else None
+                         for floor in self.floors ]
+        child.recent = list(self.recent)
+        child.borrowed = dict(self.borrowed)
+        child.borrowed.update(self.swaps)
+        self.lent.update(self.swaps.values())
+        return child
+
+    def close(self):
+        '''
+        remove all swapped-out floors from disk
+        '''
+        if self.swap_dir is not None:
+            shutil.rmtree(self.swap_dir, ignore_errors=True)
+            self.swap_dir = None
+            self.swaps = {}
+            self.lent = set()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    Field of view comparison harness. Computes the field of view from random
+    spots on generated floors with both algorithms the game offers (the
+    precise permissive one in fov.py and the shadowcasting one in
+    shadowcast.py), and reports how fast each is and how their results
+    differ:
+
+        python src/fovbench.py --floors 50 --radius 15,40 --style caves
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import random
+import time
+
+from floor import Floor, WALKABLES
+from fov import fieldOfView
+from geom import Point
+from shadowcast import field_of_view
+
+def permissive_masks(floor, row, col, radius):
+    '''
+    per-row visibility bitsets from fov.fieldOfView, computed the same way
+    Game.update_visibility does
+    '''
+    masks = [ 0 ] * floor.height
+
+    def visit(x, y):
+        masks[y] |= 1 << x
+    fieldOfView(col, row, floor.width-1, floor.height-1, radius, visit,
+                lambda x, y: floor.base_blocks_vision(y, x))
+    return masks
+
+def shadowcast_masks(floor, row, col, radius):
+    masks = [ 0 ] * floor.height
+    (top, rows) = field_of_view(floor, row, col, floor.width-1,
+                                floor.height-1, radius)
+    masks[top:top+len(rows)] = rows
+    return masks
+
+def make_floor(style, width, height):
+    if style == "caves":
+        from cave import generate_cave_floor
+        return generate_cave_floor(width, height)
+    if width * height <= 80 * 25:
+        return Floor.generate_basic_floor(width, height)
+    floor = Floor.generate_large_floor(width, height)
+    floor.generate_near(Point(0, 0), width + height)
+    return floor
+
+def count(masks):
+    return sum(bin(m).count('1') for m in masks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the speed and "
+            "results of the field of view algorithms")
+    parser.add_argument("--floors", type=int, default=20,
+            help="number of floors to generate (default: %(default)s)")
+    parser.add_argument("--views", type=int, default=50,
+            help="viewpoints per floor (default: %(default)s)")
+    parser.add_argument("--radius", default="15",
+            help="comma-separated view ranges to test (default: %(default)s)")
+    parser.add_argument("--style", choices=[ "rooms", "caves" ], default="rooms",
+            help="floor generator (default: %(default)s)")
+    parser.add_argument("--width", type=int, default=80,
+            help="floor width (default: %(default)s)")
+    parser.add_argument("--height", type=int, default=25,
+            help="floor height (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+            help="random seed (default: %(default)s)")
+    args = parser.parse_args()
+    radii = [ int(r) for r in args.radius.split(",") ]
+
+    random.seed(args.seed)
+    views = []
+    for i in range(args.floors):
+        floor = make_floor(args.style, args.width, args.height)
+        spots = [ (row, col) for row in range(floor.height - 1)
+                  for col in range(floor.width - 1)
+                  if floor.get_base(row, col) in WALKABLES ]
+        for (row, col) in random.sample(spots, min(args.views, len(spots))):
+            views.append((floor, row, col))
+
+    print ("%d views on %d %dx%d %s floors" % (len(views), args.floors,
+            args.width, args.height, args.style))
+    print ("RADIUS  PERMISSIVE  SHADOWCAST  SPEEDUP   SEEN(P)  SEEN(S)  "
+           "ONLY(P)  ONLY(S)  SAME")
+    for radius in radii:
+        times = { "p": 0.0, "s": 0.0 }
+        totals = { "p": 0, "s": 0, "only_p": 0, "only_s": 0, "same": 0 }
+        for (floor, row, col) in views:
+            start = time.perf_counter()
+            p = permissive_masks(floor, row, col, radius)
+            times["p"] += time.perf_counter() - start
+            start = time.perf_counter()
+            s = shadowcast_masks(floor, row, col, radius)
+            times["s"] += time.perf_counter() - start
+
+            totals["p"] += count(p)
+            totals["s"] += count(s)
+            totals["only_p"] += count([ a & ~b for (a, b) in zip(p, s) ])
+            totals["only_s"] += count([ b & ~a for (a, b) in zip(p, s) ])
+            totals["same"] += p == s
+        n = len(views)
+        print ("%6d  %7.1f us  %7.1f us  %6.1fx  %7.1f  %7.1f  %7.1f  %7.1f  %3.0f%%"
+               % (radius, times["p"] / n * 1e6, times["s"] / n * 1e6,
+                  times["p"] / times["s"], totals["p"] / n, totals["s"] / n,
+                  totals["only_p"] / n, totals["only_s"] / n,
+                  100.0 * totals["same"] / n))
+
+if __name__ == "__main__":
+    main()
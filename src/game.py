@@ -19,18 +19,20 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import json
+import copy
+import fcntl
 import os
 import pickle
 import random
+import sys
 import time
 
-from floor import Floor
+from floor import Floor, LAYOUT_CELL_WIDTH
+from floorstore import FloorStore
 from fov import fieldOfView
 from obj import Loot, Potion
 from npc import NPC, Bug, Segfault, Spectre
 from player import Player
-from save import GenericJSONEncoder
 
 HELP_TEXT = '''
         haxcs - an old-school roguelike with a computer science theme
@@ -56,42 +58,170 @@ HELP_TEXT = '''
 
   Actions:
 
+    x   explore automatically
+    _   travel to stairs or a selected location
     o   open door (must then indicate direction)
     q   quaff a potion
     s   sleep for a turn
+    20s type a number first to repeat a move or sleep (until interrupted)
     <   go upstairs (must be on stairs)
     >   go downstairs (must be on stairs)
 '''
 
 DEFAULT_NUM_FLOORS   =  4
+DEFAULT_RESIDENT_FLOORS = 3     # floors kept in memory in endless mode
 DEFAULT_FLOOR_WIDTH  = 80
 DEFAULT_FLOOR_HEIGHT = 25
+STATUS_ROWS          =  5       # screen rows besides the map (see render)
+
+FLOOR_STYLES         = [ "rooms", "caves", "mixed" ]
+MIXED_CAVE_CHANCE    = 0.5      # chance of a cave floor in "mixed" games
+
+FOV_ALGORITHMS       = [ "permissive", "shadowcast" ]
+
+IDLE_DELAY           = 0.05     # seconds of idleness before speculative work
+IDLE_GENERATE_CELLS  = 2        # layout cells generated ahead while idle
 
 SAVEGAME_FILENAME    = ".savegame"
 HISTORY_FILENAME     = ".history"
 HALL_OF_FAME_SLOTS   = 10
 
+class MessageHistory:
+    '''
+    The list of status messages shown by the 'M' command. A fork of a game
+    (see Game.fork) shares the messages from before the fork instead of
+    copying them, and keeps its own from then on.
+    '''
+
+    def __init__(self, earlier=None):
+        self.earlier = earlier      # the history this one was forked from
+        self.count = 0 if earlier is None else len(earlier)
+        self.own = []
+
+    def __len__(self):
+        return self.count + len(self.own)
+
+    def append(self, msg):
+        self.own.append(msg)
+
+    def last(self, n, end=None):
+        '''
+        returns the last n messages (of the first end messages, if given)
+        '''
+        if end is None:
+            end = len(self)
+        start = max(end - n, 0)
+        msgs = self.own[max(start - self.count, 0):max(end - self.count, 0)]
+        if start < self.count:
+            shared = min(end, self.count)
+            msgs = self.earlier.last(shared - start, shared) + msgs
+        return msgs
+
+    def fork(self):
+        return MessageHistory(self)
+
+class FramePacer:
+    '''
+    Decides when a game loop draws: only once every key typed ahead has been
+    handled (so a backlog of keys costs one frame, not one per key), and at
+    most max_fps times a second. Also keeps track of the input queue depth,
+    i.e., how many keys each frame covered.
+    '''
+
+    def __init__(self, max_fps=None):
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.last = None        # when the last frame was drawn
+        self.keys = 0           # keys handled since then
+        self.frames = 0
+        self.total_keys = 0
+        self.deepest = 0        # most keys covered by one frame
+
+    def next_key(self, game, screen, delay=-1):
+        '''
+        returns the next key, drawing a frame first if none is waiting;
+        delay is how long to wait for a key after that, in milliseconds
+        (negative means forever), and -1 is returned if none arrives
+        '''
+        screen.timeout(0)
+        c = screen.getch()
+        if c == -1:
+            # too soon for another frame: keep taking keys until it's time
+            wait = self.wait()
+            if wait > 0:
+                screen.timeout(int(wait * 1000) + 1)
+                c = screen.getch()
+        if c == -1:
+            game.render(screen)
+            self.drew()
+            screen.timeout(delay)
+            c = screen.getch()
+
+        # commands that prompt for more input block until they get it
+        screen.timeout(-1)
+        if c != -1:
+            self.keys += 1
+        return c
+
+    def wait(self):
+        '''
+        seconds until the next frame may be drawn
+        '''
+        if self.last is None:
+            return 0.0
+        return self.last + self.interval - time.perf_counter()
+
+    def drew(self):
+        self.last = time.perf_counter()
+        self.frames += 1
+        self.total_keys += self.keys
+        self.deepest = max(self.deepest, self.keys)
+        self.keys = 0
+
+    def report(self):
+        return "%d keys in %d frames (%.2f keys per frame, at most %d)" % \
+                (self.total_keys, self.frames,
+                 self.total_keys / max(self.frames, 1), self.deepest)
+
 class Game:
     '''
     Stores all information needed to track, display, save, and restore the state
     of a single game.
     '''
 
-    def __init__(self, player=None):
+    def __init__(self, player=None, width=DEFAULT_FLOOR_WIDTH,
+                 height=DEFAULT_FLOOR_HEIGHT, endless=False,
+                 vectorized_npcs=False, floor_style="rooms",
+                 fov_algorithm="permissive", floor_archive=None):
+
+        # in endless mode floors are generated as the player reaches them and
+        # only the most recently visited ones are kept in memory
+        self.floor_width  = width
+        self.floor_height = height
+        self.floor_style  = floor_style     # one of FLOOR_STYLES
+        self.fov_algorithm = fov_algorithm  # one of FOV_ALGORITHMS
+        self.floor_archive = floor_archive  # path of pre-generated floors
+        self.endless = endless
+        self.floors = FloorStore(DEFAULT_RESIDENT_FLOORS if endless else None)
+        self.save_filename = SAVEGAME_FILENAME
+        self.hof_filename = HISTORY_FILENAME    # None to leave out of the HOF
+        self.npcs = []
+        self.objs = []
+        self.npc_index = None   # temporary (row, col) -> NPCs map; see swarm.py
 
-        # generate first floor
-        self.floors = [Floor.generate_basic_floor(DEFAULT_FLOOR_WIDTH,
-                                                  DEFAULT_FLOOR_HEIGHT)]
+        # optionally run the simple NPC behaviors in batches with NumPy
+        if vectorized_npcs:
+            from swarm import SwarmBackend
+            self.swarm = SwarmBackend()
+        else:
+            self.swarm = None
 
-        # generate other floors
-        for i in range(1, DEFAULT_NUM_FLOORS):
-            self.floors.append(Floor.generate_basic_floor(DEFAULT_FLOOR_WIDTH,
-                                                          DEFAULT_FLOOR_HEIGHT,
-                                                          self.floors[i-1].down))
+        # victory square goes on the last floor (there isn't one in endless mode)
+        self.break_floor = None if endless else DEFAULT_NUM_FLOORS-1
+        self.break_pos = None
 
-        # close off top and bottom
-        self.floors[ 0].set_base_pt(self.floors[ 0].up,   '.')
-        self.floors[-1].set_base_pt(self.floors[-1].down, '.')
+        # generate the first floor along with its NPCs, loot, and potions
+        # (deeper floors are generated when the player first reaches them)
+        self.add_floor()
 
         # generate a random player if none is given
         if player is None:
@@ -102,179 +232,323 @@ class Game:
         # place player on upstairs of floor of dungeon
         self.player.pos = self.floors[0].up
 
-        # generate NPCs
-        self.npcs = []
-        Bug.generate(self)
-        Segfault.generate(self)
-        Spectre.generate(self)
-
-        # generate loot and potions
-        self.objs = []
-        for f in range(len(self.floors)):
-            for i in range(random.randrange(3,8)):
-                self.objs.append(Loot(f, self.floors[f].random_point_in_room(),
-                    random.randrange((f+1), 2*(f+1)+1)))
-            for i in range(random.randrange(0,3)):
-                self.objs.append(Potion(f, self.floors[f].random_point_in_room()))
-
-        # victory square
-        self.break_floor = DEFAULT_NUM_FLOORS-1
-        self.break_pos = self.floors[self.break_floor].random_point_in_room()
-
         # game info
         self.cur_turn  = 1
-        self.history = []
+        self.history = MessageHistory()
         self.set_status("Welcome! Press '?' for help text.")
         self.xray_vis  = False
 
+        # per-row visibility bitsets; FOV is computed into the back buffer and
+        # then swapped to the front so neither list is reallocated per turn
+        self.visible      = []
+        self.next_visible = []
+        self.visible_rows      = (0, 0)     # rows that may have bits set
+        self.next_visible_rows = (0, 0)
+        self.view = (0, 0, height, width)   # top, left, height, width
+        self.vis_key = None     # what the current field of view was computed for
+
         # starting visibility
         self.update_visibility()
 
 
-    def run(self, screen):
-        while self.player.hp > 0:
-
-            # draw game screen
+    def run(self, screen, pacer=None):
+        '''
+        the game loop: keys that are typed ahead (e.g., by holding a key down
+        on a slow terminal) are all handled before the screen is drawn again
+        (see FramePacer)
+        '''
+        if pacer is None:
+            pacer = FramePacer()
+        result = None
+        while result is None and self.player.hp > 0:
+            result = self.handle_key(screen, pacer.next_key(self, screen))
+
+        self.finish(screen, result)
+
+    def handle_key(self, screen, c):
+        '''
+        handle one keypress (prompting for more input if the command needs
+        it); returns None if the game goes on, or "saved" or "over" if the
+        game loop should stop
+        '''
+        cc = chr(c) if c in range(256) else '\0'
+
+        # clear status message
+        self.stat_msg = ""
+
+        # help
+        if cc == '?':
+            screen.clear()
+            screen.addstr(0, 0, HELP_TEXT)
+            screen.getch()
+
+        # show message history
+        elif cc == 'M':
+            screen.clear()
+            screen.addstr(0,0, "Messages:")
+            row = 2
+            if len(self.history) > 20:
+                screen.addstr(row, 2, "[...]")
+                row += 1
+            for msg in self.history.last(20):
+                screen.addstr(row, 2, msg)
+                row += 1
+            screen.getch()
+
+        # save
+        elif cc == 'S':
+            self.save()
+            self.add_status("Game saved.")
+            return "saved"
+
+        # quit
+        elif cc == 'Q':
+            self.set_status("Are you sure you want to quit? Press 'y' to confirm.")
+            self.render(screen)
+            if screen.getch() == ord('y'):
+                self.set_status("You quit.")
+                self.add_player_to_hof("quit")
+                return "over"
+            self.set_status("")
             self.render(screen)
 
-            # grab user input
-            c = screen.getch()
-            cc = chr(c) if c in range(256) else '\0'
-
-            # clear status message
-            self.stat_msg = ""
-
-            # help
-            if cc == '?':
-                screen.clear()
-                screen.addstr(0, 0, HELP_TEXT)
-                screen.getch()
-
-            # show message history
-            elif cc == 'M':
-                screen.clear()
-                screen.addstr(0,0, "Messages:")
-                row = 2
-                if len(self.history) > 20:
-                    screen.addstr(row, 2, "[...]")
-                    row += 1
-                for msg in self.history[-20:]:
-                    screen.addstr(row, 2, msg)
-                    row += 1
-                screen.getch()
-
-            # save
-            elif cc == 'S':
-                f = open(SAVEGAME_FILENAME, "wb")
-                pickle.dump(self, f, protocol=2)
-                f.close
-                self.add_status("Game saved.")
-                break
-
-            # quit
-            elif cc == 'Q':
-                self.set_status("Are you sure you want to quit? Press 'y' to confirm.")
-                self.render(screen)
-                if screen.getch() == ord('y'):
-                    self.set_status("You quit.")
-                    self.add_player_to_hof("quit")
-                    break
-                self.set_status("")
-                self.render(screen)
-
-            # dump
-            elif cc == 'D':
-                f = open(time.strftime("%Y_%m_%d-%H_%M_%M-") + self.player.name +
-                        "-" + self.player.race + "-" + self.player.pclass + ".sav",
-                        "w")
-                json.dump(self, f, cls=GenericJSONEncoder, indent=2)
-                f.close
-                self.add_status("Game status dumped.")
-
-            # enable x-ray vision
-            elif cc == 'X':
-                self.xray_vis = True
-                self.add_status("H4XX0rz!!1")
-
-            # player command
-            else:
-                self.player.handle_input(self, screen, c)
-
-            # victory condition
-            if self.player.hp > 0 and \
-                    self.player.floor == self.break_floor and \
-                    self.player.pos == self.break_pos:
-                self.add_status("You found a break in the game loop! You win!")
-                self.add_player_to_hof("won!")
-                break
+        # dump
+        elif cc == 'D':
+            import json
+            from save import GenericJSONEncoder
+            f = open(time.strftime("%Y_%m_%d-%H_%M_%M-") + self.player.name +
+                    "-" + self.player.race + "-" + self.player.pclass + ".sav",
+                    "w")
+            json.dump(self, f, cls=GenericJSONEncoder, indent=2)
+            f.close
+            self.add_status("Game status dumped.")
+
+        # memory report (see memreport.py)
+        elif cc == 'R':
+            from memreport import report
+            screen.clear()
+            lines = report(self)[:screen.getmaxyx()[0]]
+            for row in range(len(lines)):
+                screen.addstr(row, 0, lines[row])
+            screen.getch()
+
+        # enable x-ray vision
+        elif cc == 'X':
+            self.xray_vis = True
+            self.add_status("H4XX0rz!!1")
+
+        # player command
+        else:
+            self.player.handle_input(self, screen, c)
+
+        # victory condition
+        if self.player.hp > 0 and \
+                self.player.floor == self.break_floor and \
+                self.player.pos == self.break_pos:
+            self.add_status("You found a break in the game loop! You win!")
+            self.add_player_to_hof("won!")
+            return "over"
+        return None
+
+    def finish(self, screen, result):
+        '''
+        clean up after the game loop stops
+        '''
+        # swapped-out floors are only needed if the game is continued later
+        if result != "saved":
+            self.floors.close()
 
         # wait for final keypress (so player can see final status message)
         self.add_status("Press a key to exit.")
         self.render(screen)
         screen.getch()
 
+    async def run_async(self, screen, pacer=None):
+        '''
+        event-loop version of run: input is read without blocking through the
+        terminal's file descriptor, redraws are coalesced into one frame per
+        batch of keypresses (and paced as in run), and while the player is
+        idle the game does speculative work (see idle_steps) to make the next
+        command faster
+        '''
+        import asyncio
+        if pacer is None:
+            pacer = FramePacer()
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()     # set when the terminal has input to read
+        frame = [ None ]            # pending render callback (if any)
+
+        def draw_frame():
+            frame[0] = None
+            self.render(screen)
+            pacer.drew()
+
+        async def idle():
+            await asyncio.sleep(IDLE_DELAY)
+            for step in self.idle_steps():
+                await asyncio.sleep(0)
+                if ready.is_set():
+                    break
+
+        # keys are left in curses' input buffer until they are handled, so
+        # that commands which prompt for more input still see the typeahead
+        screen.nodelay(True)
+        loop.add_reader(sys.stdin.fileno(), ready.set)
+        result = None
+        try:
+            while result is None and self.player.hp > 0:
+
+                # only draw a frame once all typeahead has been handled
+                c = screen.getch()
+                while c == -1 and pacer.wait() > 0:
+                    # too soon for another frame: keep taking keys until it's time
+                    ready.clear()
+                    try:
+                        await asyncio.wait_for(ready.wait(), pacer.wait())
+                    except asyncio.TimeoutError:
+                        pass
+                    c = screen.getch()
+                if c == -1:
+                    frame[0] = loop.call_soon(draw_frame)
+                    idler = loop.create_task(idle())
+                    while c == -1:
+                        ready.clear()
+                        await ready.wait()
+                        c = screen.getch()
+                    idler.cancel()
+
+                # commands that prompt for more input block until they get it
+                pacer.keys += 1
+                screen.nodelay(False)
+                result = self.handle_key(screen, c)
+                screen.nodelay(True)
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+            if frame[0] is not None:
+                frame[0].cancel()
+            screen.nodelay(False)
+        self.finish(screen, result)
+
+    def idle_steps(self):
+        '''
+        generator that does a small piece of speculative work per step
+        (generating nearby parts of large floors, warming the distance maps
+        used by auto-explore and travel, and generating the next floor in
+        endless mode); steps are short so that a keypress never waits long
+        '''
+        f = self.player.floor
+        floor = self.get_cur_floor()
+
+        # generate and populate the rest of the layout near the player
+        radius = self.player.vis_range + IDLE_GENERATE_CELLS * LAYOUT_CELL_WIDTH
+        for room in floor.generate_near(self.player.pos, radius):
+            self.populate_room(f, room)
+            yield
+
+        # warm the distance maps for 'x' and for traveling to known stairs
+        goals = self.player.explore_goals(floor)
+        yield
+        if len(goals) > 0:
+            floor.distance_map(goals)
+            yield
+        for stairs in [ floor.up, floor.down ]:
+            if stairs is not None and floor.is_explored(stairs.row, stairs.col):
+                floor.distance_map([ (stairs.row, stairs.col) ])
+                yield
+
+        # generate the next floor down ahead of time
+        if self.has_floor(f+1) and f+1 == len(self.floors):
+            self.add_floor()
+            self.floors.touch(f)    # the current floor is still the most recent
+            yield
 
     def render(self, screen):
         screen.clear()
-        base = self.get_cur_floor().base
+        floor = self.get_cur_floor()
+        (max_rows, max_cols) = screen.getmaxyx()
+        self.view = self.get_view(max_rows, max_cols)
+        (top, left, field_height, field_width) = self.view
 
         # display game info
-        field_height = len(base)
-        screen.addstr(0, 0, self.stat_msg.ljust(DEFAULT_FLOOR_WIDTH))
-        screen.addstr(field_height + 3, 0,
+        screen.addstr(0, 0, self.stat_msg.ljust(DEFAULT_FLOOR_WIDTH)[:max_cols-1])
+        screen.addstr(field_height + 3, 0, (
                 self.player.name + ", Level " + str(self.player.level) + " " +
-                self.player.pclass + " (" + self.player.race + ")")
-        screen.addstr(field_height + 4, 0,
+                self.player.pclass + " (" + self.player.race + ")")[:max_cols-1])
+        screen.addstr(field_height + 4, 0, (
                 "Turn "  + str(self.cur_turn).ljust(4) + "  Floor " +
                 str(self.player.floor+1) + "  HP: " + str(self.player.hp) +
                 "/" + str(self.player.max_hp) + "  XP: " + str(self.player.xp) +
                 "/" + str(self.player.next_lvl) + "  Loot: $" + str(self.player.gp) +
-                "  Potions: " + str(self.player.potions))
-
-        # display knowledge previously gained from exploration
-        for row in range(len(base)):
-            for col in range(len(base[0])):
-                screen.addstr(row+1, col, self.get_cur_floor().explored[row][col])
+                "  Potions: " + str(self.player.potions))[:max_cols-1])
 
-        # display visible game field
-        for row in range(len(base)):
-            for col in range(len(base[0])):
-                if self.is_visible(row, col):
-                    screen.addstr(row+1, col, base[row][col])
+        # display visible game field and knowledge previously gained from
+        # exploration (one row at a time)
+        for row in range(top, top + field_height):
+            mask = (self.visible_row(row) | floor.remembered_row(row)) >> left
+            screen.addstr(row-top+1, 0,
+                    floor.masked_row(row, mask, left, left + field_width))
 
         # display victory square
-        if self.player.floor == self.break_floor and \
-                    self.is_visible(self.break_pos.row, self.break_pos.col):
-            screen.addstr(self.break_pos.row+1, self.break_pos.col, "\\")
+        if self.player.floor == self.break_floor:
+            self.draw_glyph(screen, self.break_pos, "\\")
 
         # display objects
         for obj in self.objs:
-            if obj.floor == self.player.floor and \
-                    self.is_visible(obj.pos.row, obj.pos.col):
-                screen.addstr(obj.pos.row+1, obj.pos.col, str(obj.glyph))
+            if obj.floor == self.player.floor:
+                self.draw_glyph(screen, obj.pos, str(obj.glyph))
 
         # display NPCs
         for npc in self.npcs:
-            if npc.floor == self.player.floor and \
-                    self.is_visible(npc.pos.row, npc.pos.col):
-                screen.addstr(npc.pos.row+1, npc.pos.col, str(npc.glyph))
+            if npc.floor == self.player.floor:
+                self.draw_glyph(screen, npc.pos, str(npc.glyph))
 
         # display player and set final cursor position
         if self.player.hp > 0:
-            screen.addstr(self.player.pos.row+1, self.player.pos.col, "@")
-        screen.move(self.player.pos.row+1, self.player.pos.col)
+            self.draw_glyph(screen, self.player.pos, "@")
+        screen.move(*self.screen_coords(self.player.pos))
 
         # refresh view
         screen.refresh()
 
 
+    def get_view(self, max_rows, max_cols):
+        '''
+        returns the part of the current floor that fits on a screen of the
+        given size, scrolled to follow the player: (top, left, height, width)
+        '''
+        floor = self.get_cur_floor()
+        height = max(1, min(floor.height, max_rows - STATUS_ROWS))
+        width  = max(1, min(floor.width,  max_cols))
+        top  = min(max(self.player.pos.row - height // 2, 0), floor.height - height)
+        left = min(max(self.player.pos.col - width  // 2, 0), floor.width  - width)
+        return (top, left, height, width)
+
+    def screen_coords(self, pt):
+        (top, left, height, width) = self.view
+        return (pt.row - top + 1, pt.col - left)
+
+    def draw_glyph(self, screen, pt, glyph):
+        '''
+        draw a glyph at a floor position if it is visible and on screen
+        '''
+        (top, left, height, width) = self.view
+        if pt.row >= top and pt.row < top + height and \
+                pt.col >= left and pt.col < left + width and \
+                self.is_visible(pt.row, pt.col):
+            screen.addstr(pt.row - top + 1, pt.col - left, glyph)
+
     def next_turn(self):
         self.cur_turn += 1      # increment turn counter
 
-        # run NPC AI routines
-        for npc in self.npcs:
-            if npc.floor == self.player.floor:
-                npc.do_turn(self)
+        # run NPC AI routines (only near the player)
+        cfloor = self.get_cur_floor()
+        if self.swarm is not None:
+            self.swarm.do_turns(self)
+        else:
+            for npc in self.npcs:
+                if npc.floor == self.player.floor and \
+                        cfloor.is_near(npc.pos, self.player.pos):
+                    npc.do_turn(self)
 
         # handle any object acquisition
         for obj in self.objs:
@@ -310,10 +584,163 @@ class Game:
     def get_cur_floor(self):
         return self.floors[self.player.floor]
 
+    def add_floor(self):
+        '''
+        generate the next floor down and stock it with NPCs and objects
+        '''
+        f = len(self.floors)
+        floor = self.generate_floor(self.floors[f-1].down if f > 0 else None,
+                                    self.choose_floor_style(f))
+        self.floors.append(floor)
+
+        # close off top and bottom
+        if f == 0:
+            floor.set_base_pt(floor.up, '.')
+        if f == self.break_floor:
+            floor.set_base_pt(floor.down, '.')
+
+        # generate NPCs
+        Bug.generate(self, f)
+        Segfault.generate(self, f)
+        if f == self.break_floor or (self.endless and
+                f % DEFAULT_NUM_FLOORS == DEFAULT_NUM_FLOORS-1):
+            Spectre.generate(self, f)
+
+        # generate loot and potions
+        for i in range(random.randrange(3,8)):
+            self.objs.append(Loot(f, floor.random_point_in_room(),
+                random.randrange((f+1), 2*(f+1)+1)))
+        for i in range(random.randrange(0,3)):
+            self.objs.append(Potion(f, floor.random_point_in_room()))
+
+        # victory square
+        if f == self.break_floor:
+            self.break_pos = floor.random_point_in_room()
+
+    def has_floor(self, f):
+        return f >= 0 and (self.endless or f <= self.break_floor)
+
+    def change_floor(self, f):
+        '''
+        move the player to another floor, generating it or loading it back
+        from disk if necessary, and evict floors that haven't been visited
+        recently
+        '''
+        self.get_cur_floor().sim_turn = self.cur_turn
+        if f == len(self.floors):
+            self.add_floor()
+        elif not self.floors.is_resident(f):
+            (npcs, objs) = self.floors.load(f)
+            self.npcs.extend(npcs)
+            self.objs.extend(objs)
+        self.player.floor = f
+        self.floors.touch(f)
+        self.catch_up_floor(f)
+        if self.swarm is not None:
+            self.swarm.reset()
+
+        for victim in self.floors.victims():
+            npcs = [ npc for npc in self.npcs if npc.floor == victim ]
+            objs = [ obj for obj in self.objs if obj.floor == victim ]
+            self.npcs = [ npc for npc in self.npcs if npc.floor != victim ]
+            self.objs = [ obj for obj in self.objs if obj.floor != victim ]
+            self.floors.evict(victim, (npcs, objs))
+
+    def catch_up_floor(self, f):
+        '''
+        NPCs only move while the player is on their floor, so when the player
+        comes back to a floor, fast-forward its NPCs through the turns that
+        passed since it was left, with one estimate per NPC (see
+        NPC.catch_up) rather than one simulated move per turn
+        '''
+        cfloor = self.floors[f]
+        if cfloor.sim_turn is None:
+            return                      # first visit
+        turns = self.cur_turn - cfloor.sim_turn
+        npcs = [ npc for npc in self.npcs if npc.floor == f ]
+        occupied = set([ (npc.pos.row, npc.pos.col) for npc in npcs ])
+        for npc in npcs:
+            occupied.discard((npc.pos.row, npc.pos.col))
+            npc.catch_up(self, turns, occupied)
+            occupied.add((npc.pos.row, npc.pos.col))
+        cfloor.sim_turn = None
+
+    def choose_floor_style(self, f):
+        '''
+        decide how floor f is generated ("rooms" or "caves"); in "mixed" games
+        every floor after the first is picked at random
+        '''
+        if self.floor_style == "mixed":
+            if f > 0 and random.random() < MIXED_CAVE_CHANCE:
+                return "caves"
+            return "rooms"
+        return self.floor_style
+
+    def choose_fov_algorithm(self, cfloor):
+        '''
+        decide how the field of view is computed on a floor (one of
+        FOV_ALGORITHMS): the floor's own choice if it has one, otherwise
+        this game's
+        '''
+        if cfloor.fov_algorithm is not None:
+            return cfloor.fov_algorithm
+        return self.fov_algorithm
+
+    def generate_floor(self, up=None, style="rooms"):
+        '''
+        generate a new floor of this game's size; room floors are taken from
+        the floor archive if there is one with a matching floor, and room
+        floors bigger than the default size are laid out as a grid and
+        generated lazily
+        '''
+        large = self.floor_width * self.floor_height > \
+                DEFAULT_FLOOR_WIDTH * DEFAULT_FLOOR_HEIGHT
+        if style == "caves":
+            from cave import generate_cave_floor
+            return generate_cave_floor(self.floor_width, self.floor_height, up,
+                                       large)
+        if self.floor_archive is not None:
+            from floorarchive import open_archive
+            archive = open_archive(self.floor_archive)
+            if archive is not None:
+                floor = archive.draw(self.floor_width, self.floor_height, up)
+                if floor is not None:
+                    return floor
+        if not large:
+            return Floor.generate_basic_floor(self.floor_width,
+                                              self.floor_height, up)
+        return Floor.generate_large_floor(self.floor_width,
+                                          self.floor_height, up)
+
+    def populate_room(self, f, room):
+        '''
+        stock a room that was just generated on a large floor
+        '''
+        floor = self.floors[f]
+        if random.random() < 0.5:
+            self.objs.append(Loot(f, floor.random_point_in_rect(room),
+                random.randrange((f+1), 2*(f+1)+1)))
+        if random.random() < 0.1:
+            self.objs.append(Potion(f, floor.random_point_in_rect(room)))
+        Bug.generate_in_room(self, f, room)
+        Segfault.generate_in_room(self, f, room)
+
     def get_cur_floor_base_pt(self, pt):
         return self.get_cur_floor().get_base_pt(pt)
 
+    def add_npc(self, npc):
+        self.npcs.append(npc)
+        if self.swarm is not None:
+            self.swarm.added(npc)
+
+    def remove_npc(self, npc):
+        self.npcs.remove(npc)
+        if self.swarm is not None:
+            self.swarm.removed(npc)
+
     def npcs_at(self, floor, pos):
+        if self.npc_index is not None and floor == self.player.floor:
+            return list(self.npc_index.get((pos.row, pos.col), []))
         npcs = []
         for npc in self.npcs:
             if npc.floor == floor and npc.pos == pos:
@@ -326,64 +753,158 @@ class Game:
     def nothing_at(self, floor, pos):
         return self.no_npcs_at(floor, pos) and not (self.player.pos == pos)
 
+    def npcs_in_room(self, floor, room_id):
+        '''
+        returns the NPCs in a room (given by its index in the floor's rooms)
+        '''
+        room_id_at = self.floors[floor].room_id_at
+        return [ npc for npc in self.npcs if npc.floor == floor and
+                 room_id_at(npc.pos.row, npc.pos.col) == room_id ]
+
+    def objs_in_room(self, floor, room_id):
+        room_id_at = self.floors[floor].room_id_at
+        return [ obj for obj in self.objs if obj.floor == floor and
+                 room_id_at(obj.pos.row, obj.pos.col) == room_id ]
+
     def clear_visibility(self):
-        self.visible = []
-        for row in range(len(self.get_cur_floor().base)):
-            line = [False] * len(self.get_cur_floor().base[0])
-            self.visible.append(line)
+        height = self.get_cur_floor().height
+        if len(self.next_visible) != height:
+            self.next_visible = [0] * height
+        else:
+            for row in range(*self.next_visible_rows):
+                self.next_visible[row] = 0
+        vis_range = self.player.vis_range
+        self.next_visible_rows = (max(self.player.pos.row - vis_range, 0),
+                min(self.player.pos.row + vis_range + 1, height))
 
     def update_visibility(self):
+        # make sure everything the player could see has been generated
+        for room in self.get_cur_floor().generate_near(self.player.pos,
+                self.player.vis_range + LAYOUT_CELL_WIDTH):
+            self.populate_room(self.player.floor, room)
+
+        # nothing to do if neither the player nor the floor has changed
+        # (e.g., while sleeping)
+        cfloor = self.get_cur_floor()
+        key = (self.player.floor, cfloor.version, self.player.pos.row,
+               self.player.pos.col, self.player.vis_range,
+               self.choose_fov_algorithm(cfloor))
+        if key == self.vis_key:
+            return
+        self.vis_key = key
+
         self.clear_visibility()
-        fieldOfView(self.player.pos.col, self.player.pos.row,
-                len(self.get_cur_floor().base[0])-1,
-                len(self.get_cur_floor().base)-1,
-                self.player.vis_range,
-                (lambda x, y: self.set_visible(y,x) ),
-                (lambda x, y: self.get_cur_floor().base_blocks_vision(y,x) ))
+        if self.choose_fov_algorithm(cfloor) == "shadowcast":
+            from shadowcast import field_of_view
+            (top, masks) = field_of_view(cfloor,
+                    self.player.pos.row, self.player.pos.col,
+                    cfloor.width-1, cfloor.height-1, self.player.vis_range)
+            for i in range(len(masks)):
+                self.next_visible[top+i] |= masks[i]
+        else:
+            fieldOfView(self.player.pos.col, self.player.pos.row,
+                    cfloor.width-1, cfloor.height-1,
+                    self.player.vis_range,
+                    (lambda x, y: self.set_visible(y,x) ),
+                    (lambda x, y: cfloor.base_blocks_vision(y,x) ))
+
+        # a lit room is seen all at once from anywhere inside it (or its doors)
+        room_id = cfloor.room_id_at(self.player.pos.row, self.player.pos.col)
+        if room_id is not None and cfloor.is_lit(room_id):
+            (top, bottom, mask) = cfloor.room_mask(room_id)
+            for row in range(top, bottom):
+                self.next_visible[row] |= mask
+            self.next_visible_rows = (min(self.next_visible_rows[0], top),
+                                      max(self.next_visible_rows[1], bottom))
+
+        # swap buffers and merge the new field of view into the explored map
+        self.visible, self.next_visible = self.next_visible, self.visible
+        self.visible_rows, self.next_visible_rows = \
+                self.next_visible_rows, self.visible_rows
+        self.get_cur_floor().explore_rows(self.visible, *self.visible_rows)
 
     def set_visible(self, row, col):
-        self.visible[row][col] = True
-        self.get_cur_floor().explore(row, col)
+        self.next_visible[row] |= 1 << col
 
     def is_visible(self, row, col):
-        return self.xray_vis or self.visible[row][col]
+        return self.xray_vis or (self.visible[row] >> col) & 1 == 1
+
+    def visible_row(self, row):
+        if self.xray_vis:
+            return (1 << self.get_cur_floor().width) - 1
+        return self.visible[row]
+
+    def fork(self):
+        '''
+        returns a copy of this game for looking ahead (e.g., by a bot trying
+        out moves): floors share their tiles with this game's until one of
+        the games writes to them, and the message history so far is shared;
+        the NPCs and the player are copied (shallowly, since positions and
+        stats are replaced rather than changed in place). Forks are left out
+        of the hall of fame.
+        '''
+        child = copy.copy(self)
+        child.floors = self.floors.fork()
+        child.npcs = [ copy.copy(npc) for npc in self.npcs ]
+        child.objs = list(self.objs)
+        child.player = copy.copy(self.player)
+        child.history = self.history.fork()
+        child.visible = list(self.visible)
+        child.next_visible = list(self.next_visible)
+        child.hof_filename = None
+        return child
+
+    def save(self):
+        f = open(self.save_filename, "wb")
+        pickle.dump(self, f, protocol=2)
+        f.close()
 
     def add_player_to_hof(self, status):
+        if self.hof_filename is None:
+            return
+        # other games (e.g., in a server) may be updating the file too
+        f = open(self.hof_filename, "a+b")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
         try:
-            f = open(HISTORY_FILENAME, "rb")
             all_games = pickle.load(f)
-            f.close()
-        except IOError:
+        except EOFError:
             all_games = []
         all_games.append([self.player.xp + self.player.gp, status, self.cur_turn,
                     self.player.name + " the level " + str(self.player.level) +
                     " " + self.player.race + " " + self.player.pclass,
                     self.xray_vis])
-        f = open(HISTORY_FILENAME, "wb")
+        f.seek(0)
+        f.truncate()
         pickle.dump(all_games, f, protocol=2)
         f.close()
 
     @staticmethod
-    def print_hof():
+    def hof_text():
         f = open(HISTORY_FILENAME, "rb")
+        fcntl.flock(f, fcntl.LOCK_SH)
         all_games = pickle.load(f)
         f.close()
         all_games.sort()
         all_games.reverse()
-        print ("Hall of fame:")
-        print (    "  %5s   %6s   %5s   %-50s   %s" % ("SCORE", "STATUS", "TURNS", "NAME", "CHEATED?"))
+        lines = [ "Hall of fame:" ]
+        lines.append("  %5s   %6s   %5s   %-50s   %s" % ("SCORE", "STATUS", "TURNS", "NAME", "CHEATED?"))
         for rec in all_games[:HALL_OF_FAME_SLOTS]:
-            print ("  %5d   %6s   %5d   %-50s   %c" % (rec[0], rec[1], rec[2], rec[3],
+            lines.append("  %5d   %6s   %5d   %-50s   %c" % (rec[0], rec[1], rec[2], rec[3],
                 'X' if rec[4] else ' '))
+        return "\n".join(lines)
 
     @staticmethod
-    def load_savegame():
+    def print_hof():
+        print (Game.hof_text())
+
+    @staticmethod
+    def load_savegame(filename=SAVEGAME_FILENAME):
         try:
-            f = open(SAVEGAME_FILENAME, "rb")
+            f = open(filename, "rb")
             game = pickle.load(f)
             f.close
-            os.remove(SAVEGAME_FILENAME)
+            os.remove(filename)
             return game
         except IOError:
             return None
-
@@ -18,24 +18,110 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+# the start-up timer has to be in place before anything else is imported
+if "--timing" in sys.argv:
+    from timing import StartupTimer
+    timer = StartupTimer(STARTED)
+    timer.watch_imports()
+else:
+    timer = None
+
+import argparse
 import random
-import curses
 
-from game import Game
+from game import Game, FramePacer, DEFAULT_FLOOR_WIDTH, DEFAULT_FLOOR_HEIGHT, \
+        FLOOR_STYLES, FOV_ALGORITHMS
+
+if timer:
+    timer.mark("imports done")
 
 def main():
 
+    parser = argparse.ArgumentParser(description="an old-school roguelike "
+            "with a computer science theme")
+    parser.add_argument("--width", type=int, default=DEFAULT_FLOOR_WIDTH,
+            help="floor width for new games (default: %(default)s)")
+    parser.add_argument("--height", type=int, default=DEFAULT_FLOOR_HEIGHT,
+            help="floor height for new games (default: %(default)s)")
+    parser.add_argument("--endless", action="store_true",
+            help="start a new game with no bottom floor")
+    parser.add_argument("--floor-style", choices=FLOOR_STYLES, default="rooms",
+            help="how new floors are generated: rooms and corridors, caves "
+                 "(requires NumPy), or a mix (default: %(default)s)")
+    parser.add_argument("--fov", choices=FOV_ALGORITHMS, default="permissive",
+            help="field of view algorithm for new games: precise permissive, "
+                 "or faster symmetric shadowcasting (default: %(default)s)")
+    parser.add_argument("--floor-archive", metavar="FILE", default=None,
+            help="draw new room floors from an archive of pre-generated "
+                 "floors (see floorarchive.py)")
+    parser.add_argument("--vectorized-npcs", action="store_true",
+            help="run simple NPC behaviors in batches (requires NumPy)")
+    parser.add_argument("--async-loop", action="store_true",
+            help="use the event-loop driver (does background work while idle)")
+    parser.add_argument("--renderer", choices=[ "curses", "ansi" ],
+            default="curses",
+            help="draw with curses, or by sending only the changed parts of "
+                 "each frame as plain ANSI sequences (default: %(default)s)")
+    parser.add_argument("--max-fps", type=float, default=None,
+            help="draw at most this many frames a second (keys typed in "
+                 "between are still handled right away)")
+    parser.add_argument("--timing", action="store_true",
+            help="report start-up timing (with an import breakdown) and "
+                 "input queue depth on exit")
+    parser.add_argument("--memory-report", action="store_true",
+            help="trace allocations and report memory use by subsystem on "
+                 "exit (also shown in game with 'R')")
+    args = parser.parse_args()
+
     # initialize game (loading previous savegame if present)
     random.seed()
     main_game = Game.load_savegame()
     if main_game is None:
-        main_game = Game()
+        main_game = Game(width=args.width, height=args.height,
+                         endless=args.endless,
+                         vectorized_npcs=args.vectorized_npcs,
+                         floor_style=args.floor_style,
+                         fov_algorithm=args.fov,
+                         floor_archive=args.floor_archive)
+    if timer:
+        timer.mark("first floor generated")
+    if args.memory_report:
+        import memreport
+
+    def start(screen):
+        if timer:
+            timer.mark("screen initialized")
+            main_game.render(screen)
+            timer.mark("first frame drawn")
+        if args.memory_report:
+            memreport.start_tracing(main_game)      # (gameplay only)
+        if args.async_loop:
+            import asyncio
+            asyncio.run(main_game.run_async(screen, pacer))
+        else:
+            main_game.run(screen, pacer)
 
     # main game loop
-    curses.wrapper(main_game.run)
+    pacer = FramePacer(args.max_fps)
+    if args.renderer == "ansi":
+        import ansi
+        ansi.wrapper(start)
+    else:
+        import curses
+        curses.wrapper(start)
 
     # print hall of fame
     Game.print_hof()
+    if timer:
+        print (timer.report())
+        print ("Input: " + pacer.report())
+    if args.memory_report:
+        print ("\n".join(memreport.report(main_game)))
 
 main()
 
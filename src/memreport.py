@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains the memory report behind the 'R' key and the
+    --memory-report flag. It breaks a game's memory down by subsystem (floors,
+    entities, messages, caches) by walking the objects each one owns, gives
+    the size of the game as a savegame, and, when allocations are being traced
+    with tracemalloc, how much memory each turn adds and where it comes from.
+
+    Run on its own, it is a benchmark that plays headless games with a simple
+    bot and reports the per-game footprint:
+
+        python src/memreport.py --games 3 --turns 500
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import gc
+import os
+import pickle
+import random
+import sys
+import tracemalloc
+import types
+
+REPORTED_SITES = 8          # allocation sites listed in the report
+TRACE_FRAMES = 16           # frames kept per traced allocation
+
+# objects that belong to the program rather than to a game
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+_baseline = None            # (turn, snapshot) when tracing started
+
+def deep_size(objs, seen):
+    '''
+    total size in bytes of the given objects and everything reachable from
+    them that isn't in seen (which is updated, so objects shared between
+    subsystems are only counted for the first one)
+    '''
+    total = 0
+    stack = list(objs)
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+    return total
+
+def subsystem_sizes(game):
+    '''
+    returns (subsystem, bytes) pairs for a game; caches are counted first so
+    that the floors and the game that hold them don't count them again, and
+    "other" is whatever is left of the game
+    '''
+    floors = [ f for f in game.floors.floors if f is not None ]
+    caches = [ game.visible, game.next_visible, game.npc_index ]
+    for f in floors:
+        caches += [ f.dist_cache, f.room_tiles, f.room_tile_index ]
+    seen = set()
+    sizes = [ ("caches",   deep_size(caches, seen)),
+              ("messages", deep_size([ game.history ], seen)),
+              ("entities", deep_size([ game.npcs, game.objs, game.player ], seen)),
+              ("floors",   deep_size([ game.floors ], seen)) ]
+    sizes.append(("other", deep_size([ game ], seen)))
+    return sizes
+
+def start_tracing(game):
+    '''
+    start tracing allocations, so that later reports include how much memory
+    each turn adds from now on
+    '''
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+    _baseline = (game.cur_turn, take_snapshot())
+
+def take_snapshot():
+    '''
+    snapshot of the live allocations, leaving out garbage that is only
+    waiting to be collected and the report's own allocations
+    '''
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, os.path.abspath(__file__)) ])
+
+def game_frame(traceback):
+    '''
+    the innermost frame of a traceback that is in the game's own code
+    (allocations made in the standard library are charged to the game code
+    that called it)
+    '''
+    this = os.path.abspath(__file__)
+    for frame in reversed(traceback):
+        if os.path.dirname(frame.filename) == os.path.dirname(this) and \
+                frame.filename != this:
+            return frame
+    return traceback[-1]
+
+def allocation_report(game):
+    '''
+    report lines for the memory allocated since start_tracing (net, per
+    turn, and by source line)
+    '''
+    if _baseline is None or not tracemalloc.is_tracing():
+        return [ "Allocations: not traced (start with --memory-report)" ]
+    (turn, before) = _baseline
+    after = take_snapshot()
+    (current, peak) = tracemalloc.get_traced_memory()
+    sites = {}                  # (file, line) -> [ bytes, blocks ]
+    for d in after.compare_to(before, "traceback"):
+        frame = game_frame(d.traceback)
+        site = sites.setdefault((os.path.basename(frame.filename),
+                                 frame.lineno), [ 0, 0 ])
+        site[0] += d.size_diff
+        site[1] += d.count_diff
+    growth = sum(size for (size, count) in sites.values())
+    turns = max(game.cur_turn - turn, 1)
+    lines = [ "Allocations (traced): %.1f KB now, %.1f KB peak"
+              % (current / 1024.0, peak / 1024.0),
+              "  %+.1f KB over %d turns (%+.0f bytes per turn)"
+              % (growth / 1024.0, turns, growth / turns),
+              "  largest growth by source line:" ]
+    largest = sorted(sites.items(), key=lambda s: -s[1][0])
+    for ((filename, lineno), (size, count)) in largest[:REPORTED_SITES]:
+        if size > 0:
+            lines.append("  %8.1f KB  %6d blocks  %s:%d"
+                         % (size / 1024.0, count, filename, lineno))
+    return lines
+
+def save_size(game):
+    '''
+    size in bytes of the game as a savegame (see Game.save)
+    '''
+    return len(pickle.dumps(game, protocol=2))
+
+def report(game):
+    '''
+    returns the memory report for a game as a list of lines
+    '''
+    allocations = allocation_report(game)     # (before the report allocates)
+    sizes = subsystem_sizes(game)
+    total = sum(size for (name, size) in sizes)
+    lines = [ "Memory by subsystem (turn %d, %d floors resident):"
+              % (game.cur_turn, len(game.floors.recent)) ]
+    for (name, size) in sizes:
+        lines.append("  %8.1f KB  %5.1f%%  %s"
+                     % (size / 1024.0, 100.0 * size / total, name))
+    lines.append("  %8.1f KB          total" % (total / 1024.0))
+    lines.append("Savegame: %.1f KB" % (save_size(game) / 1024.0))
+    return lines + allocations
+
+def play(game, screen, turns):
+    '''
+    benchmark bot: explore each floor, then take the stairs down; returns
+    False if the game ended first
+    '''
+    while game.cur_turn < turns:
+        if game.player.hp < game.player.max_hp // 3 and game.player.potions > 0:
+            keys = "q"
+        elif game.get_cur_floor().get_base_pt(game.player.pos) == '>':
+            keys = ">"
+        else:
+            keys = "x"
+        screen.keys = [ ord(k) for k in keys[1:] ]
+        turn = game.cur_turn
+        if game.handle_key(screen, ord(keys[0])) is not None or \
+                game.player.hp <= 0:
+            return False
+        if game.cur_turn == turn:
+            # nothing left to explore (or no way to it): head for the stairs
+            screen.keys = [ ord('>') ]
+            game.handle_key(screen, ord('_'))
+            if game.cur_turn == turn:
+                game.handle_key(screen, ord('s'))
+    return True
+
+def main():
+    from game import Game
+    from rlenv import HeadlessScreen
+
+    parser = argparse.ArgumentParser(description="Measure the memory used "
+            "by headless games played by a simple bot")
+    parser.add_argument("--games", type=int, default=3,
+            help="number of games to play (default: %(default)s)")
+    parser.add_argument("--turns", type=int, default=500,
+            help="turns per game (default: %(default)s)")
+    parser.add_argument("--endless", action="store_true",
+            help="play endless games")
+    parser.add_argument("--seed", type=int, default=0,
+            help="random seed (default: %(default)s)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    screen = HeadlessScreen()
+    totals = []
+    for i in range(args.games):
+        game = Game(endless=args.endless)
+        game.hof_filename = None
+        start_tracing(game)
+        finished = play(game, screen, args.turns)
+        print ("Game %d: %s on floor %d" % (i + 1,
+                "played" if finished else "ended", game.player.floor))
+        lines = report(game)
+        print ("\n".join("  " + line for line in lines))
+        totals.append(sum(size for (name, size) in subsystem_sizes(game)))
+        game.floors.close()
+    print ("Mean footprint: %.1f KB per game"
+           % (sum(totals) / len(totals) / 1024.0))
+
+if __name__ == "__main__":
+    main()
@@ -47,8 +47,10 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import math
 import random
 
+from dice import Dice
 from geom import Point
 
 D_UP        = Point(-1, 0)
@@ -78,7 +80,7 @@ class NPC:
         self.name  = "Glitch"
         self.glyph = "?"
         self.hp    = 500
-        self.dmg   = "1d9001"
+        self.dmg   = Dice.parse("1d9001")
         self.kxp   = "42"
         self.turns_till_death = 6       # five ticks
 
@@ -88,18 +90,41 @@ class NPC:
         if self.turns_till_death == 0:
             game.player.kill()
 
-    def roll_damage(self):
+    def catch_up(self, game, turns, occupied):
+        '''
+        approximate the effect of the given number of turns spent away from
+        the player in one go (see Game.catch_up_floor); occupied is the set of
+        (row, col) positions taken by other NPCs on the floor
+        '''
+        pass
 
-        # figure out which dice to roll
-        tmp = self.dmg.split('d')
-        num = int(tmp[0])
-        max_dmg = int(tmp[1])
+    def walk_toward(self, game, target, dirs, steps, occupied, stop_dist=0):
+        '''
+        move greedily toward a target for at most the given number of steps,
+        stopping early if blocked or within stop_dist tiles (used by catch_up;
+        each step gets strictly closer, so this is bounded by the distance)
+        '''
+        cfloor = game.floors[self.floor]
+        for i in range(steps):
+            if max(abs(self.pos.row - target.row),
+                   abs(self.pos.col - target.col)) <= stop_dist:
+                return
+            best = None
+            best_dist = target.dist_sq(self.pos)
+            for d in dirs:
+                newpt = self.pos.add(d)
+                if target.dist_sq(newpt) < best_dist and \
+                        cfloor.get_base_pt(newpt) in self.WALKABLE and \
+                        (newpt.row, newpt.col) not in occupied and \
+                        newpt != game.player.pos:
+                    best = newpt
+                    best_dist = target.dist_sq(newpt)
+            if best is None:
+                return
+            self.pos = best
 
-        # roll the dice
-        total_dmg = 0
-        for i in range(num):
-            total_dmg = random.randint(1, max_dmg)
-        return total_dmg
+    def roll_damage(self):
+        return self.dmg.roll()
 
     def handle_attack(self, game, attacker):
         pass
@@ -113,13 +138,13 @@ class zach(NPC):
         # become less common the deeper you dive into the system
           for f in range(len(game.floors)):
               for i in range(random.randrange(0, 10-f)):
-                 game.npcs.append(Bug(f, game.floors[f].random_point_in_room()))
+                 game.add_npc(Bug(f, game.floors[f].random_point_in_room()))
     
     def setup(self):
         self.name  = "Zach"
         self.glyph = "Z"
         self.hp    = 5
-        self.dmg   = "1d1"
+        self.dmg   = Dice.parse("1d1")
         self.kxp   = 5
 
     def pos_clear(self, game, pos):
@@ -154,12 +179,12 @@ class zach(NPC):
                     newpt = self.pos.add(d)
                     if self.pos_clear(game, self.pos.add(d)):
                         game.add_status("Zach reproduces!")
-                        game.npcs.append(Bug(self.floor, newpt))
+                        game.add_npc(Bug(self.floor, newpt))
                         break
             else:
                 # bug is actually dead
                 game.add_status("He deserved what he got")
-                game.npcs.remove(self)
+                game.remove_npc(self)
                 game.player.xp += self.kxp
 
                 # display special message if all bugs on the floor are dead
@@ -184,17 +209,22 @@ class Bug(NPC):
     WALKABLE = [ '.', '#', '<', '>' ]
 
     @staticmethod
-    def generate(game):
+    def generate(game, f):
         # become less common the deeper you dive into the system
-        for f in range(len(game.floors)):
-            for i in range(random.randrange(0, 10-f)):
-                game.npcs.append(Bug(f, game.floors[f].random_point_in_room()))
+        for i in range(random.randrange(0, max(10-f, 1))):
+            game.add_npc(Bug(f, game.floors[f].random_point_in_room()))
+
+    @staticmethod
+    def generate_in_room(game, f, room):
+        # (rooms on large floors are stocked individually)
+        if random.random() < (10-f) / 20.0:
+            game.add_npc(Bug(f, game.floors[f].random_point_in_rect(room)))
 
     def setup(self):
         self.name  = "Bug"
         self.glyph = "x"
         self.hp    = 1
-        self.dmg   = "1d2"
+        self.dmg   = Dice.parse("1d2")
         self.kxp   = 1
 
     def pos_clear(self, game, pos):
@@ -204,11 +234,8 @@ class Bug(NPC):
     def do_turn(self, game):
 
         # if beside player, attack
-        for d in D_CARDINAL:
-            if self.pos.add(d) == game.player.pos:
-                game.add_status("The bug manifests!")
-                game.player.take_dmg(self.roll_damage())
-                return
+        if self.attack_if_adjacent(game):
+            return
 
         # otherwise, with 2/3 probability wander aimlessly in a cardinal direction
         if random.random() < 0.67:
@@ -216,6 +243,25 @@ class Bug(NPC):
             if self.pos_clear(game, newpt):
                 self.pos = newpt
 
+    def catch_up(self, game, turns, occupied):
+        # a bug steps in a random cardinal direction on 2/3 of its turns, so
+        # after n turns it has drifted a normally-distributed distance with a
+        # variance of n/3 along each axis (less if it runs into walls)
+        spread = math.sqrt(turns * 0.67 / 2)
+        target = self.pos.offset(round(random.gauss(0, spread)),
+                                 round(random.gauss(0, spread)))
+        self.walk_toward(game, target, D_CARDINAL,
+                abs(target.row - self.pos.row) + abs(target.col - self.pos.col),
+                occupied)
+
+    def attack_if_adjacent(self, game):
+        for d in D_CARDINAL:
+            if self.pos.add(d) == game.player.pos:
+                game.add_status("The bug manifests!")
+                game.player.take_dmg(self.roll_damage())
+                return True
+        return False
+
     def handle_attack(self, game, attacker):
         self.hp -= attacker.roll_damage()
         if self.hp <= 0:
@@ -229,17 +275,17 @@ class Bug(NPC):
                     newpt = self.pos.add(d)
                     if self.pos_clear(game, self.pos.add(d)):
                         game.add_status("The bug reproduces!")
-                        game.npcs.append(Bug(self.floor, newpt))
+                        game.add_npc(Bug(self.floor, newpt))
                         break
             else:
                 # bug is actually dead
                 game.add_status("The bug has been fixed!")
-                game.npcs.remove(self)
+                game.remove_npc(self)
                 game.player.xp += self.kxp
 
                 # display special message if all bugs on the floor are dead
                 for npc in game.npcs:
-                    if npc.name == "Bug" and npc.floor == self.floor:
+                    if npc.floor == self.floor and isinstance(npc, Bug):
                         return
                 game.add_status("Floor is bug-free!")
 
@@ -256,17 +302,23 @@ class Segfault(NPC):
     WALKABLE = [ '.', '#', '<', '>' ]
 
     @staticmethod
-    def generate(game):
-        # become more common the deeper you dive into the system
-        for f in range(len(game.floors)):
-            for i in range(random.randrange(f, (f+1)*2+1)):
-                game.npcs.append(Segfault(f, game.floors[f].random_point_in_room()))
+    def generate(game, f):
+        # become more common the deeper you dive into the system (up to a point)
+        depth = min(f, 8)
+        for i in range(random.randrange(depth, (depth+1)*2+1)):
+            game.add_npc(Segfault(f, game.floors[f].random_point_in_room()))
+
+    @staticmethod
+    def generate_in_room(game, f, room):
+        # (rooms on large floors are stocked individually)
+        if random.random() < (f+1) / 10.0:
+            game.add_npc(Segfault(f, game.floors[f].random_point_in_rect(room)))
 
     def setup(self):
         self.name  = "Segfault"
         self.glyph = "v"
         self.hp    = 4
-        self.dmg   = "1d4"
+        self.dmg   = Dice.parse("1d4")
         self.kxp   = 2
 
     def pos_clear(self, game, pos):
@@ -276,12 +328,26 @@ class Segfault(NPC):
     def do_turn(self, game):
 
         # with 3/4 probability, attack player if beside them
-        if random.random() < 0.75:
-            for d in D_ALLDIRS:
-                if self.pos.add(d) == game.player.pos:
-                    game.add_status("Segmentation fault!")
-                    game.player.take_dmg(self.roll_damage())
-                    return
+        if random.random() < 0.75 and self.attack_if_adjacent(game):
+            return
+        self.move(game)
+
+    def catch_up(self, game, turns, occupied):
+        # a segfault chases the player on 2/3 of its turns, so while the
+        # player is away it drifts toward the stairs they left by (which is
+        # where they come back); it stops short so as not to ambush them
+        self.walk_toward(game, game.player.pos, D_ALLDIRS,
+                int(turns * 0.67), occupied, stop_dist=2)
+
+    def attack_if_adjacent(self, game):
+        for d in D_ALLDIRS:
+            if self.pos.add(d) == game.player.pos:
+                game.add_status("Segmentation fault!")
+                game.player.take_dmg(self.roll_damage())
+                return True
+        return False
+
+    def move(self, game):
 
         # otherwise, with 2/3 probability, try to get closer to player
         if random.random() < 0.67:
@@ -307,7 +373,7 @@ class Segfault(NPC):
         game.add_status("The segfault was hit for " + str(dmg) + " damage.")
         if self.hp <= 0:
             game.add_status("The segfault has been handled!")
-            game.npcs.remove(self)
+            game.remove_npc(self)
             game.player.xp += self.kxp
 
 
@@ -325,16 +391,15 @@ class Spectre(NPC):
     WALKABLE = [ '.', '#', '<', '>', ' ' ]
 
     @staticmethod
-    def generate(game):
+    def generate(game, f):
         # spawn one on the lowest floor of the system
-        game.npcs.append(Spectre(len(game.floors)-1,
-                game.floors[-1].random_point_in_room()))
+        game.add_npc(Spectre(f, game.floors[f].random_point_in_room()))
 
     def setup(self):
         self.name  = "Spectre"
         self.glyph = "&"
         self.hp    = 40
-        self.dmg   = "2d6"
+        self.dmg   = Dice.parse("2d6")
         self.kxp   = 4
         self.lastppos = self.pos    # for speculative execution
         self.prevppos = self.pos
@@ -343,6 +408,13 @@ class Spectre(NPC):
         return game.floors[self.floor].get_base_pt(pos) in self.WALKABLE and \
                game.nothing_at(self.floor, pos)
 
+    def catch_up(self, game, turns, occupied):
+        # the spectre teleports around the floor at will, so after a while
+        # away it could be anywhere
+        if turns > 0:
+            self.pos = game.floors[self.floor].random_point_in_room()
+            self.lastppos = self.prevppos = self.pos
+
     def do_turn(self, game):
 
         # speculate as to the player's current position using their last two
@@ -404,6 +476,6 @@ class Spectre(NPC):
         game.add_status("The spectre was hit for " + str(dmg) + " damage.")
         if self.hp <= 0:
             game.add_status("The spectre has a meltdown! It is dead.")
-            game.npcs.remove(self)
+            game.remove_npc(self)
             game.player.xp += self.kxp
 
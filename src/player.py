@@ -19,6 +19,7 @@
 """
 
 import random
+from dice import Dice
 from geom import Point
 
 NAMES = ["Alice", "Bob", "Charlie", "David", "Eve", "Frank", "Grace", "Heidi",
@@ -46,6 +47,10 @@ DIRECTION_OFFSETS = {
     'n': Point( 1, 1), 'N': Point( 1, 1)
 }
 
+MAX_TRAVEL_STEPS = 1000     # safety limit for auto-explore and travel
+MAX_COUNT = 9999            # largest repeat count (e.g., "20s")
+REPEATABLE = set(LCASE_DIRECTIONS) | { 's' }  # commands a count applies to
+
 class Player:
     '''
     PC-related data and logic
@@ -59,7 +64,7 @@ class Player:
         self.next_lvl  = XP_LEVELS[1]
         self.hp        = 15
         self.max_hp    = 15
-        self.dmg       = "1d6"
+        self.dmg       = Dice.parse("1d6")
         self.vis_range = 15
         self.gp        = 0
         self.potions   = 3
@@ -75,18 +80,31 @@ class Player:
         cc = chr(c) if c in range(256) else '\0'
         cfloor = game.get_cur_floor()
 
+        # repeat count: read digits up to the command and run it that many times
+        if cc in "123456789":
+            count = 0
+            while cc.isdigit():
+                count = min(count * 10 + int(cc), MAX_COUNT)
+                game.stat_msg = "Count: " + str(count) + " "
+                game.render(screen)
+                c = screen.getch()
+                cc = chr(c) if c in range(256) else '\0'
+            game.stat_msg = ""
+            if cc in REPEATABLE:
+                self.repeat(game, screen, c, count)
+
         # go upstairs
-        if cc == '<':
-            if self.floor > 0 and cfloor.get_base_pt(self.pos) == '<':
-                self.floor -= 1
+        elif cc == '<':
+            if game.has_floor(self.floor-1) and cfloor.get_base_pt(self.pos) == '<':
+                game.change_floor(self.floor-1)
                 game.add_status("You go up the stairs.")
                 game.next_turn()
 
         # go downstairs
         elif cc == '>':
-            if self.floor < len(game.floors)-1 and \
+            if game.has_floor(self.floor+1) and \
                     cfloor.get_base_pt(self.pos) == '>':
-                self.floor += 1
+                game.change_floor(self.floor+1)
                 game.add_status("You go down the stairs.")
                 game.next_turn()
 
@@ -107,6 +125,21 @@ class Player:
                 self.pos = self.pos.add(DIRECTION_OFFSETS[cc])
                 game.next_turn()
 
+        # walk toward the nearest unexplored territory
+        elif cc == 'x':
+            get_goals = lambda: self.explore_goals(cfloor)
+            if len(get_goals()) == 0 or \
+                    get_goals() == [ (self.pos.row, self.pos.col) ]:
+                game.add_status("Nothing left to explore.")
+            else:
+                self.travel(game, get_goals)
+
+        # travel to the stairs or a selected tile
+        elif cc == '_':
+            target = self.choose_travel_target(game, screen)
+            if target is not None:
+                self.travel(game, lambda: [ (target.row, target.col) ])
+
         # open door
         elif cc == 'o':
             d = chr(screen.getch())
@@ -131,6 +164,44 @@ class Player:
             else:
                 game.add_status("You have no potions.")
 
+    def repeat(self, game, screen, c, count):
+        '''
+        run a command up to count times in a row without redrawing in
+        between; stops as soon as a new NPC comes into view, the player is
+        hurt, a message arrives, the command doesn't take a turn (e.g.,
+        walking into a wall), or the player reaches the break in the loop
+        '''
+        seen = set(id(npc) for npc in self.visible_npcs(game))
+        for i in range(count):
+            (turn, hp, msgs) = (game.cur_turn, self.hp, len(game.history))
+            self.handle_input(game, screen, c)
+            if game.cur_turn == turn or self.hp < hp or \
+                    len(game.history) > msgs:
+                break
+            if self.floor == game.break_floor and self.pos == game.break_pos:
+                break
+            if any(id(npc) not in seen for npc in self.visible_npcs(game)):
+                break
+
+    def visible_npcs(self, game):
+        return [ npc for npc in game.npcs if npc.floor == self.floor and
+                 game.is_visible(npc.pos.row, npc.pos.col) ]
+
+    def explore_goals(self, cfloor):
+        '''
+        returns the frontier tiles that auto-explore walks toward
+        '''
+        return cfloor.frontier()
+
+    def npcs_nearby(self, game, pt):
+        '''
+        returns the NPCs next to a point
+        '''
+        npcs = []
+        for _,d in DIRECTION_OFFSETS.items():
+            npcs += game.npcs_at(self.floor, pt.add(d))
+        return npcs
+
     def can_keep_walking(self, game, offset):
         '''
         determine whether SHIFT-dir walking can continue (next step must be
@@ -149,6 +220,103 @@ class Player:
                 return False
         return True;
 
+    def choose_travel_target(self, game, screen):
+        '''
+        prompt for a travel destination: '<' or '>' picks the stairs, or a
+        cursor can be moved with the direction keys and confirmed with '.'
+        '''
+        cfloor = game.get_cur_floor()
+        game.set_status("Travel where? (<, >, or move the cursor and press .)")
+        game.render(screen)
+        cursor = self.pos
+        while True:
+            c = screen.getch()
+            cc = chr(c) if c in range(256) else '\0'
+            if cc == '<' or cc == '>':
+                target = cfloor.up if cc == '<' else cfloor.down
+                if target is None or not cfloor.is_explored(target.row, target.col):
+                    game.set_status("You don't know where the stairs are.")
+                    return None
+                break
+            elif cc == '.' or cc == '_':
+                target = cursor
+                break
+            elif cc in LCASE_DIRECTIONS or cc in UCASE_DIRECTIONS:
+                step = 1 if cc in LCASE_DIRECTIONS else 8
+                for i in range(step):
+                    pt = cursor.add(DIRECTION_OFFSETS[cc])
+                    if cfloor.is_inside(pt.row, pt.col):
+                        cursor = pt
+                screen.move(*game.screen_coords(cursor))
+                screen.refresh()
+            else:
+                game.set_status("Never mind.")
+                return None
+        game.set_status("")
+        if not game.is_visible(target.row, target.col) and \
+                not cfloor.is_explored(target.row, target.col):
+            game.set_status("You can't see that location.")
+            return None
+        return target
+
+    def travel(self, game, get_goals):
+        '''
+        walk along a cached distance map toward the closest of the goals
+        returned by get_goals (re-evaluated every step); stops on arriving at
+        a goal, as soon as a threat appears or the player is hurt, or when no
+        further progress is possible (including when a step leads back to a
+        tile already visited on this trip)
+        '''
+        cfloor = game.get_cur_floor()
+        visited = { (self.pos.row, self.pos.col) }
+        for i in range(MAX_TRAVEL_STEPS):
+            goals = get_goals()
+            here = (self.pos.row, self.pos.col)
+            if len(goals) == 0 or here in goals:
+                break
+            dist = cfloor.distance_map(goals)
+            if here not in dist:
+                if i == 0:
+                    game.add_status("You don't know how to get there.")
+                break
+
+            # pick the neighbor closest to a goal
+            best = None
+            for _,d in DIRECTION_OFFSETS.items():
+                pt = (self.pos.row + d.row, self.pos.col + d.col)
+                if pt in dist and dist[pt] < dist[here] and \
+                        (best is None or dist[pt] < dist[best[0]]):
+                    best = (pt, d)
+            if best is None:
+                break
+            offset = best[1]
+
+            # doors on the way are opened just as the 'o' command would
+            newpt = self.pos.add(offset)
+            if cfloor.get_base_pt(newpt) == '+':
+                cfloor.set_base_pt(newpt, '.')
+                game.add_status("The door opens.")
+                game.next_turn()
+                continue
+
+            # stop for the same reasons that SHIFT-dir walking does
+            if not self.can_keep_walking(game, offset):
+                npcs = game.npcs_at(self.floor, newpt) + \
+                        self.npcs_nearby(game, self.pos) + \
+                        self.npcs_nearby(game, newpt)
+                if len(npcs) > 0:
+                    game.add_status("You stop--there's a " + npcs[0].name +
+                                    " nearby.")
+                break
+            hp = self.hp
+            self.pos = newpt
+            game.next_turn()
+            if self.hp < hp:
+                break
+            if (self.pos.row, self.pos.col) in visited:
+                break
+            visited.add((self.pos.row, self.pos.col))
+
     def level_up(self, game):
         '''
         handle the process of leveling up (can handle multiple levels
@@ -164,18 +332,9 @@ class Player:
     def roll_damage(self):
         '''
         roll dice to determine player damage
+        (e.g., "2d6" means "roll two 6-sided dice")
         '''
-        # figure out which dice to roll
-        # (e.g., "2d6" means "roll two 6-sided dice")
-        tmp = self.dmg.split('d')
-        num = int(tmp[0])
-        max_dmg = int(tmp[1])
-
-        # roll the dice and add up the total damage
-        total_dmg = 0
-        for i in range(num):
-            total_dmg = random.randint(1, max_dmg)
-        return total_dmg
+        return self.dmg.roll()
 
     def heal(self, amount):
         self.hp = min(self.hp + amount, self.max_hp)
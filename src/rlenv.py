@@ -0,0 +1,319 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains a programmatic interface to the game for bots (e.g.,
+    for reinforcement learning): an environment with reset and step methods
+    that runs a game without curses and returns observations as NumPy arrays,
+    and a vectorized version that steps many games in lockstep, optionally in
+    worker processes that write their observations into shared memory.
+
+        env = GameEnv()
+        obs = env.reset(seed=1)
+        (obs, reward, done, info) = env.step(ACTIONS.index('l'))
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import multiprocessing
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from game import Game, DEFAULT_FLOOR_WIDTH, DEFAULT_FLOOR_HEIGHT, STATUS_ROWS
+
+# actions are key sequences, handled exactly as if the player typed them
+# (prompts that get no answer are cancelled as if with ESC)
+ACTIONS = [ 'h', 'j', 'k', 'l', 'y', 'u', 'b', 'n',     # move or attack
+            's', 'q', '<', '>',                         # sleep, quaff, stairs
+            'x', '_<', '_>',                            # explore, travel
+            'oh', 'oj', 'ok', 'ol', 'oy', 'ou', 'ob', 'on' ]    # open door
+
+# observation channels (each is a height x width array of bytes for the
+# player's current floor)
+CHANNELS = [ "base",        # base characters (as the floor stores them)
+             "explored",    # 1 where the player has been able to see
+             "visible",     # 1 where the player can see now
+             "npcs",        # glyphs of NPCs, and '@' for the player
+             "objs" ]       # glyphs of objects
+
+WIN_REWARD = 100            # on top of the score gained (experience + gold)
+
+ESC = 27
+
+class HeadlessScreen:
+    '''
+    Stands in for the curses window: drawing does nothing and getch returns
+    queued keys (and ESC once they run out).
+    '''
+
+    def __init__(self, rows=DEFAULT_FLOOR_HEIGHT+STATUS_ROWS,
+                 cols=DEFAULT_FLOOR_WIDTH):
+        self.rows = rows
+        self.cols = cols
+        self.keys = []
+
+    def getch(self):
+        return self.keys.pop(0) if len(self.keys) > 0 else ESC
+
+    def getmaxyx(self):
+        return (self.rows, self.cols)
+
+    def addstr(self, *args):
+        pass
+
+    def erase(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def move(self, row, col):
+        pass
+
+    def refresh(self):
+        pass
+
+def unpack_rows(masks, width):
+    '''
+    converts a list of per-row bitsets into an array of zeros and ones
+    '''
+    size = (width + 7) // 8
+    data = b''.join([ m.to_bytes(size, 'little') for m in masks ])
+    bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8),
+                            bitorder='little')
+    return bits.reshape(len(masks), size * 8)[:, :width]
+
+class GameEnv:
+    '''
+    One game as an environment. Each environment keeps its own random
+    state, so games seeded the same way play out the same way however many
+    other games are run alongside them. Games are kept out of the hall of
+    fame. Extra keyword arguments are passed on to Game (the field of view
+    defaults to the faster shadowcasting algorithm).
+    '''
+
+    def __init__(self, width=DEFAULT_FLOOR_WIDTH, height=DEFAULT_FLOOR_HEIGHT,
+                 max_turns=None, **options):
+        if numpy is None:
+            raise ImportError("the environment interface requires NumPy")
+        self.width = width
+        self.height = height
+        self.max_turns = max_turns
+        self.options = dict(options)
+        self.options.setdefault("fov_algorithm", "shadowcast")
+        self.screen = HeadlessScreen(height + STATUS_ROWS, width)
+        self.random_state = random.Random().getstate()
+        self.game = None
+        self.score = 0
+        self.base = (None, None, None)  # floor, floor version, base channel
+
+    def shape(self):
+        return (len(CHANNELS), self.height, self.width)
+
+    def run(self, func, *args):
+        '''
+        call a function with this environment's random state in place of
+        the global one
+        '''
+        outer = random.getstate()
+        random.setstate(self.random_state)
+        try:
+            return func(*args)
+        finally:
+            self.random_state = random.getstate()
+            random.setstate(outer)
+
+    def reset(self, seed=None, out=None):
+        '''
+        start a new game (from the given seed, if any); returns the first
+        observation (written into out if given)
+        '''
+        if seed is not None:
+            self.random_state = random.Random(seed).getstate()
+        self.game = self.run(self.new_game)
+        self.score = 0
+        return self.observe(out)
+
+    def new_game(self):
+        game = Game(width=self.width, height=self.height, **self.options)
+        game.hof_filename = None
+        return game
+
+    def step(self, action, out=None):
+        '''
+        perform an action (an index into ACTIONS); returns the observation,
+        the reward (score gained, plus WIN_REWARD for winning), whether the
+        game is over, and a dictionary of extra information
+        '''
+        self.screen.keys = [ ord(k) for k in ACTIONS[action] ]
+        result = self.run(self.game.handle_key, self.screen, self.screen.getch())
+        player = self.game.player
+        score = player.xp + player.gp
+        reward = score - self.score
+        self.score = score
+        won = result == "over" and player.hp > 0
+        if won:
+            reward += WIN_REWARD
+        done = result is not None or player.hp <= 0 or \
+                (self.max_turns is not None and self.game.cur_turn >= self.max_turns)
+        info = { "turn": self.game.cur_turn, "floor": player.floor,
+                 "hp": player.hp, "score": score, "won": won }
+        return (self.observe(out), reward, done, info)
+
+    def observe(self, out=None):
+        '''
+        returns the current observation (see CHANNELS)
+        '''
+        if out is None:
+            out = numpy.zeros(self.shape(), dtype=numpy.uint8)
+        game = self.game
+        cfloor = game.get_cur_floor()
+        f = game.player.floor
+        # (the base characters only change when a tile is written)
+        if self.base[0] is not cfloor or self.base[1] != cfloor.version:
+            rows = [ cfloor.base_row(row).encode('latin-1')
+                     for row in range(self.height) ]
+            base = numpy.frombuffer(b''.join(rows), dtype=numpy.uint8)
+            self.base = (cfloor, cfloor.version,
+                         base.reshape(self.height, self.width))
+        out[0] = self.base[2]
+        out[1] = unpack_rows(cfloor.explored, self.width)
+        out[2] = unpack_rows(game.visible, self.width)
+        out[3:5] = 0
+        for npc in game.npcs:
+            if npc.floor == f:
+                out[3, npc.pos.row, npc.pos.col] = ord(npc.glyph)
+        out[3, game.player.pos.row, game.player.pos.col] = ord('@')
+        for obj in game.objs:
+            if obj.floor == f:
+                out[4, obj.pos.row, obj.pos.col] = ord(obj.glyph)
+        return out
+
+def env_worker(conn, shm, shape, first, count, env_args):
+    '''
+    worker process entry point: runs some of a VecGameEnv's games, writing
+    their observations into the shared buffer
+    '''
+    obs = numpy.ndarray(shape, dtype=numpy.uint8, buffer=shm.buf)
+    envs = [ GameEnv(**env_args) for i in range(count) ]
+    while True:
+        (command, arg) = conn.recv()
+        if command == "reset":
+            for i in range(count):
+                envs[i].reset(arg[i], obs[first + i])
+            conn.send(None)
+        elif command == "step":
+            conn.send([ step_env(envs[i], arg[i], obs[first + i])
+                        for i in range(count) ])
+        else:
+            break
+    conn.close()
+
+def step_env(env, action, out):
+    '''
+    step one of a VecGameEnv's games, starting a new one when it ends
+    '''
+    (obs, reward, done, info) = env.step(action, out)
+    if done:
+        env.reset(None, out)
+    return (reward, done, info)
+
+class VecGameEnv:
+    '''
+    Many games stepped in lockstep. Observations are stacked into one array
+    (games x channels x height x width); finished games are restarted
+    automatically, so the observation returned for a game that just ended is
+    the first one of its next game. With workers > 0 the games are divided
+    among that many processes and observations are written to shared memory.
+    '''
+
+    def __init__(self, count, workers=0, **env_args):
+        if numpy is None:
+            raise ImportError("the environment interface requires NumPy")
+        self.count = count
+        self.workers = min(workers, count)
+        shape = (count,) + GameEnv(**env_args).shape()
+        if self.workers == 0:
+            self.envs = [ GameEnv(**env_args) for i in range(count) ]
+            self.obs = numpy.zeros(shape, dtype=numpy.uint8)
+            return
+
+        from multiprocessing import shared_memory
+        self.shm = shared_memory.SharedMemory(create=True,
+                size=int(numpy.prod(shape)))
+        self.obs = numpy.ndarray(shape, dtype=numpy.uint8, buffer=self.shm.buf)
+        context = multiprocessing.get_context("fork")
+        self.conns = []
+        self.procs = []
+        self.slices = []
+        for w in range(self.workers):
+            first = count * w // self.workers
+            last = count * (w+1) // self.workers
+            (conn, child) = context.Pipe()
+            proc = context.Process(target=env_worker, daemon=True,
+                    args=(child, self.shm, shape, first, last - first, env_args))
+            proc.start()
+            self.conns.append(conn)
+            self.procs.append(proc)
+            self.slices.append((first, last))
+
+    def reset(self, seeds=None):
+        '''
+        start new games (seeds is a list with a seed or None for each game);
+        returns the stacked observations
+        '''
+        if seeds is None:
+            seeds = [ None ] * self.count
+        if self.workers == 0:
+            for i in range(self.count):
+                self.envs[i].reset(seeds[i], self.obs[i])
+        else:
+            for (conn, (first, last)) in zip(self.conns, self.slices):
+                conn.send(("reset", seeds[first:last]))
+            for conn in self.conns:
+                conn.recv()
+        return self.obs
+
+    def step(self, actions):
+        '''
+        perform one action in each game; returns the stacked observations,
+        an array of rewards, an array of done flags, and a list of info
+        dictionaries
+        '''
+        if self.workers == 0:
+            results = [ step_env(self.envs[i], actions[i], self.obs[i])
+                        for i in range(self.count) ]
+        else:
+            for (conn, (first, last)) in zip(self.conns, self.slices):
+                conn.send(("step", list(actions[first:last])))
+            results = []
+            for conn in self.conns:
+                results.extend(conn.recv())
+        rewards = numpy.array([ r[0] for r in results ], dtype=numpy.float32)
+        dones = numpy.array([ r[1] for r in results ], dtype=bool)
+        return (self.obs, rewards, dones, [ r[2] for r in results ])
+
+    def close(self):
+        if self.workers == 0:
+            return
+        for conn in self.conns:
+            conn.send(("close", None))
+        for proc in self.procs:
+            proc.join()
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    Multi-session game server. A few worker processes share one listening
+    socket, and each worker hosts many games (one thread per connection), so
+    every player doesn't pay for a whole interpreter:
+
+        python src/server.py serve --port 7777 --workers 2
+        python src/server.py play --port 7777
+        python src/server.py watch alice
+
+    Each connection gets its own game, drawn with ANSI escape sequences.
+    Games are saved per player name in a shared save directory (and are saved
+    automatically if the connection drops); the hall of fame is shared by all
+    sessions. Games left idle are hibernated to disk until the player returns.
+    Anyone on the server's machine can watch a game in progress through its
+    spectator feed (a Unix socket named after the player; see spectate.py).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import fcntl
+import multiprocessing
+import os
+import pickle
+import random
+import select
+import shutil
+import signal
+import socket
+import sys
+import termios
+import threading
+import time
+import tty
+import zlib
+
+from ansi import AnsiScreen
+from game import Game, FramePacer
+from spectate import FrameFeed
+
+DEFAULT_HOST    = "127.0.0.1"
+DEFAULT_PORT    = 7777
+DEFAULT_WORKERS = 2
+SAVE_DIRNAME    = "saves"
+WATCH_DIRNAME   = "watch"           # spectator sockets (inside the save dir)
+MAX_NAME_LENGTH = 16
+SAVE_SUFFIX     = ".sav"
+IDLE_SUFFIX     = ".idle"           # hibernated games
+WATCH_SUFFIX    = ".sock"
+LOCK_SUFFIX     = ".lock"           # held while a player's game is in use
+DEFAULT_IDLE_TIMEOUT = 300          # seconds
+
+def read_name(screen):
+    '''
+    prompt for a player name (letters and digits only); returns None if the
+    player gives up
+    '''
+    name = ""
+    while True:
+        screen.erase()
+        screen.addstr(0, 0, "Welcome to haxcs!")
+        screen.addstr(2, 0, "Name: " + name)
+        c = screen.getch()
+        if c in (ord('\r'), ord('\n')) and len(name) > 0:
+            return name
+        elif c in (3, 4, 27):               # ^C, ^D, ESC
+            return None
+        elif c in (8, 127):                 # backspace
+            name = name[:-1]
+        elif chr(c).isalnum() and c < 128 and len(name) < MAX_NAME_LENGTH:
+            name += chr(c)
+
+class RestoreStats:
+    '''
+    running statistics on how long it takes to wake hibernated games (shared
+    by all sessions in a worker process)
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.worst = max(self.worst, seconds)
+            print ("[%d] woke %s in %.1f ms (%d wakeups: mean %.1f ms, max %.1f ms)"
+                   % (os.getpid(), name, seconds * 1000.0, self.count,
+                      self.total / self.count * 1000.0, self.worst * 1000.0),
+                   flush=True)
+
+restore_stats = RestoreStats()
+
+class Session:
+    '''
+    One player's connection. The game is run one command at a time; if the
+    player doesn't press a key for idle_timeout seconds between commands, the
+    game is hibernated (written to disk in compressed form and dropped from
+    memory) until the next keypress.
+    '''
+
+    def __init__(self, conn, save_dir, idle_timeout, floor_archive=None,
+                 max_fps=None):
+        self.conn = conn
+        self.screen = AnsiScreen(conn.fileno(), conn.fileno())
+        self.save_dir = save_dir
+        self.idle_timeout = idle_timeout
+        self.floor_archive = floor_archive
+        self.pacer = FramePacer(max_fps)
+        self.name = None
+        self.game = None        # None while hibernated (or before login)
+        self.feed = None
+        self.lock = None        # open lock file while this session owns the name
+
+    def path(self, suffix):
+        return os.path.join(self.save_dir, self.name + suffix)
+
+    def login(self):
+        '''
+        ask for the player's name and load their game (a game that was
+        hibernated when the server stopped counts as saved); returns False if
+        the player gives up or the name is already being played
+        '''
+        self.name = read_name(self.screen)
+        if self.name is None:
+            return False
+        if not self.lock_name():
+            self.screen.erase()
+            self.screen.addstr(0, 0, self.name + " is already playing.")
+            self.screen.refresh()
+            self.screen.write(b"\r\n")
+            return False
+        if os.path.exists(self.path(IDLE_SUFFIX)):
+            self.wake()
+        else:
+            self.game = Game.load_savegame(self.path(SAVE_SUFFIX))
+        if self.game is None:
+            self.game = Game(floor_archive=self.floor_archive)
+            self.game.player.name = self.name
+        self.game.save_filename = self.path(SAVE_SUFFIX)
+        try:
+            self.feed = FrameFeed(watch_path(self.save_dir, self.name))
+        except OSError:
+            self.feed = None    # (someone else's feed is there; no spectators)
+        self.screen.feed = self.feed
+        return True
+
+    def lock_name(self):
+        '''
+        take the lock on the player's name (a flock, so that it holds across
+        worker processes and is dropped if this one dies); returns False if
+        another session holds it
+        '''
+        f = open(self.path(LOCK_SUFFIX), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self.lock = f
+        return True
+
+    def unlock_name(self):
+        if self.lock is not None:
+            fcntl.flock(self.lock, fcntl.LOCK_UN)
+            self.lock.close()
+            self.lock = None
+
+    def hibernate(self):
+        data = zlib.compress(pickle.dumps(self.game, pickle.HIGHEST_PROTOCOL))
+        f = open(self.path(IDLE_SUFFIX), "wb")
+        f.write(data)
+        f.close()
+        self.game = None
+
+    def wake(self):
+        start = time.perf_counter()
+        f = open(self.path(IDLE_SUFFIX), "rb")
+        self.game = pickle.loads(zlib.decompress(f.read()))
+        f.close()
+        os.remove(self.path(IDLE_SUFFIX))
+        restore_stats.add(self.name, time.perf_counter() - start)
+
+    def run(self):
+        '''
+        the same loop as Game.run, with hibernation between commands
+        '''
+        if self.idle_timeout > 0:
+            timeout = int(self.idle_timeout * 1000)
+        else:
+            timeout = -1
+        result = None
+        while result is None and self.game.player.hp > 0:
+            c = self.pacer.next_key(self.game, self.screen, timeout)
+            if c == -1:
+                self.hibernate()
+                c = self.screen.getch()
+                self.wake()
+            result = self.game.handle_key(self.screen, c)
+        self.game.finish(self.screen, result)
+        self.game = None        # over (or saved by the player)
+        self.screen.erase()
+        self.screen.addstr(0, 0, Game.hof_text())
+        self.screen.refresh()
+        self.screen.write(b"\r\n")
+
+    def hang_up(self):
+        '''
+        keep the game of a player who disconnected so that it can be resumed
+        '''
+        if self.lock is None:
+            return              # not logged in (or someone else's game)
+        if self.game is None and \
+                os.path.exists(self.path(IDLE_SUFFIX)):
+            self.wake()
+        if self.game is not None and self.game.player.hp > 0:
+            self.game.save()
+
+def run_session(conn, save_dir, idle_timeout, floor_archive, max_fps):
+    '''
+    host one player's game on a connection (runs in its own thread)
+    '''
+    session = Session(conn, save_dir, idle_timeout, floor_archive, max_fps)
+    try:
+        if session.login():
+            session.run()
+    except (EOFError, OSError):
+        session.hang_up()
+    finally:
+        if session.feed is not None:
+            session.feed.close()
+        session.unlock_name()
+        conn.close()
+        if session.name is not None:
+            print ("[%d] %s left: %s" % (os.getpid(), session.name,
+                   session.pacer.report()), flush=True)
+
+def worker(listener, save_dir, idle_timeout, floor_archive, max_fps):
+    '''
+    accept connections on a shared listening socket and host each one's game
+    in a thread (runs in each worker process)
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    random.seed()       # don't share a random sequence with other workers
+    while True:
+        (conn, addr) = listener.accept()
+        threading.Thread(target=run_session,
+                         args=(conn, save_dir, idle_timeout, floor_archive,
+                               max_fps),
+                         daemon=True).start()
+
+def serve(host, port, workers, save_dir, idle_timeout, floor_archive=None,
+          max_fps=None):
+    os.makedirs(os.path.join(save_dir, WATCH_DIRNAME), exist_ok=True)
+    if floor_archive is not None:
+        # map the archive before forking so that the workers share it
+        from floorarchive import open_archive
+        if open_archive(floor_archive) is None:
+            print ("can't read floor archive " + floor_archive +
+                   "; generating floors live")
+    listener = socket.create_server((host, port))
+    print ("haxcs server listening on " + host + ":" + str(port) +
+           " (" + str(workers) + " worker processes)")
+    context = multiprocessing.get_context("fork")
+    procs = [ context.Process(target=worker, args=(listener, save_dir,
+                                                   idle_timeout, floor_archive,
+                                                   max_fps))
+              for i in range(workers) ]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+
+def play(host, port):
+    '''
+    minimal terminal client: passes keys to the server and its output to the
+    terminal, and reports the terminal's size (again whenever it changes)
+    '''
+    conn = socket.create_connection((host, port))
+    stdin = sys.stdin.fileno()
+    stdout = sys.stdout.fileno()
+
+    def send_size(*args):
+        (cols, rows) = shutil.get_terminal_size()
+        conn.sendall(b'\x1b[8;%d;%dt' % (rows, cols))
+    send_size()
+    signal.signal(signal.SIGWINCH, send_size)
+
+    saved = termios.tcgetattr(stdin)
+    tty.setraw(stdin)
+    try:
+        os.write(stdout, b'\x1b[?1049h')    # use the alternate screen
+        while True:
+            try:
+                (readable, _, _) = select.select([ conn, stdin ], [], [])
+            except InterruptedError:
+                continue
+            if conn in readable:
+                data = conn.recv(65536)
+                if len(data) == 0:
+                    break
+                os.write(stdout, data)
+            if stdin in readable:
+                conn.sendall(os.read(stdin, 1024))
+    finally:
+        termios.tcsetattr(stdin, termios.TCSADRAIN, saved)
+        os.write(stdout, b'\x1b[?1049l')
+        conn.close()
+
+def watch_path(save_dir, name):
+    return os.path.join(save_dir, WATCH_DIRNAME, name + WATCH_SUFFIX)
+
+def watch(save_dir, name):
+    '''
+    spectator client: shows a game in progress until it ends (or ^C)
+    '''
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(watch_path(save_dir, name))
+    except OSError:
+        print ("Nobody called " + name + " is playing right now.")
+        return
+    stdout = sys.stdout.fileno()
+    os.write(stdout, b'\x1b[?1049h')        # use the alternate screen
+    try:
+        while True:
+            data = conn.recv(65536)
+            if len(data) == 0:
+                break
+            os.write(stdout, data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.write(stdout, b'\x1b[?1049l')
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="haxcs multi-session server")
+    parser.add_argument("mode", choices=[ "serve", "play", "watch" ],
+            help="run the server, connect to one as a player, or watch a "
+                 "game on this machine's server")
+    parser.add_argument("name", nargs="?",
+            help="player to watch (watch mode only)")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+            help="address to listen on or connect to (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+            help="TCP port (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+            help="server worker processes (default: %(default)s)")
+    parser.add_argument("--save-dir", default=SAVE_DIRNAME,
+            help="directory for per-player save files (default: %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+            help="seconds before an idle game is hibernated to disk; 0 to "
+                 "never hibernate (default: %(default)s)")
+    parser.add_argument("--floor-archive", metavar="FILE", default=None,
+            help="draw new floors from an archive of pre-generated floors "
+                 "(see floorarchive.py)")
+    parser.add_argument("--max-fps", type=float, default=None,
+            help="frames per second sent to each player at most (keys "
+                 "typed in between are still handled right away)")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        serve(args.host, args.port, args.workers, args.save_dir,
+              args.idle_timeout, args.floor_archive, args.max_fps)
+    elif args.mode == "watch":
+        if args.name is None:
+            parser.error("watch mode needs the name of a player")
+        watch(args.save_dir, args.name)
+    else:
+        play(args.host, args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains the spectator feed that lets people watch a game on
+    the server (see server.py). The game's screen publishes each update it
+    sends to the player once, already encoded as ANSI row changes, and a
+    background thread serves that one stream to every spectator connected to
+    the game's local socket. The stream starts over from a keyframe (a full
+    redraw) every so often; spectators join at the latest keyframe, and ones
+    that fall too far behind skip ahead to it, so the game never waits for a
+    slow spectator and the feed's memory use stays bounded.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import os
+import select
+import socket
+import threading
+
+KEYFRAME_INTERVAL = 100     # frames between keyframes
+
+def in_use(path):
+    '''
+    returns true if something is listening on the Unix socket at path
+    '''
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+class FrameFeed:
+    '''
+    One game's spectator feed on a Unix socket. The game's thread calls
+    publish for every frame; everything else happens on the feed's own
+    thread. Each spectator just has a position in the shared list of frames
+    and whatever part of them the socket hasn't taken yet.
+    '''
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        if os.path.exists(path):
+            if in_use(path):
+                raise OSError(errno.EADDRINUSE, "spectator socket in use", path)
+            os.remove(path)     # (left behind by a server that died)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.inode = os.stat(path).st_ino   # so close only removes our own
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+        self.lock = threading.Lock()
+        self.frames = []        # encoded frames; the first is a keyframe
+        self.first = 0          # sequence number of frames[0]
+        self.closed = False
+        (self.wake_in, self.wake_out) = os.pipe()
+        os.set_blocking(self.wake_out, False)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def publish(self, frame, keyframe):
+        '''
+        add a frame to the stream; keyframe is a function that encodes the
+        whole screen, called instead of using the frame when it's time for a
+        new keyframe (this never blocks on spectators)
+        '''
+        with self.lock:
+            if len(self.frames) == 0 or len(self.frames) > self.keyframe_interval:
+                self.first += len(self.frames)
+                self.frames = [ keyframe() ]
+            else:
+                self.frames.append(frame)
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self.wake_out, b'!')
+        except BlockingIOError:
+            pass                # (already awake)
+
+    def close(self):
+        self.closed = True
+        self.wake()
+        self.thread.join()
+
+    def pending(self, watcher):
+        '''
+        the frames a spectator hasn't been given yet (as one string of
+        bytes); spectators that have fallen behind the latest keyframe skip
+        ahead to it
+        '''
+        with self.lock:
+            start = max(watcher[0], self.first)
+            watcher[0] = self.first + len(self.frames)
+            return b''.join(self.frames[start - self.first:])
+
+    def serve(self):
+        '''
+        accept spectators and send them the stream (runs on its own thread)
+        '''
+        watchers = {}           # socket -> [ next frame number, unsent bytes ]
+        while not self.closed:
+            end = self.first + len(self.frames)
+            sending = [ conn for (conn, w) in watchers.items()
+                        if len(w[1]) > 0 or w[0] < end ]
+            (readable, writable, _) = select.select(
+                    [ self.listener, self.wake_in ] + list(watchers), sending, [])
+            if self.wake_in in readable:
+                os.read(self.wake_in, 4096)
+            if self.listener in readable:
+                try:
+                    (conn, addr) = self.listener.accept()
+                    conn.setblocking(False)
+                    watchers[conn] = [ self.first, b'' ]    # start at the keyframe
+                except BlockingIOError:
+                    pass
+            for conn in writable:
+                w = watchers[conn]
+                if len(w[1]) == 0:
+                    w[1] = self.pending(w)
+                try:
+                    w[1] = w[1][conn.send(w[1]):]
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    conn.close()
+                    del watchers[conn]
+            for conn in readable:
+                if conn in watchers:
+                    try:
+                        data = conn.recv(1024)  # (spectators don't send anything)
+                    except OSError:
+                        data = b''
+                    if len(data) == 0:
+                        conn.close()
+                        del watchers[conn]
+
+        for conn in watchers:
+            conn.close()
+        self.listener.close()
+        os.close(self.wake_in)
+        os.close(self.wake_out)
+        try:
+            if os.stat(self.path).st_ino == self.inode:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,250 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains an optional NPC backend that runs the simple NPC
+    behaviors for a whole floor as one batched NumPy step, so that floors with
+    huge swarms of bugs can still be played at interactive speeds.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from floor import ACTIVE_CHUNK_RADIUS, CHUNK_SIZE
+from geom import Point
+from npc import Bug, Segfault
+
+KIND_OTHER    = 0
+KIND_BUG      = 1
+KIND_SEGFAULT = 2
+KINDS = { Bug: KIND_BUG, Segfault: KIND_SEGFAULT }
+
+CARDINAL_OFFSETS = [ (-1, 0), (1, 0), (0, -1), (0, 1) ]   # same order as D_CARDINAL
+
+class NPCArrays:
+    '''
+    Struct-of-arrays store of the NPCs on one floor: positions and type IDs
+    in parallel arrays. It is built once when the player arrives and then
+    kept up to date as NPCs spawn, die, and move; NPCs that die are only
+    marked dead until the next compact, so indices stay valid for a turn.
+    '''
+
+    def __init__(self, floor, npcs):
+        self.floor = floor
+        self.npcs = list(npcs)
+        self.pos = numpy.array([ (npc.pos.row, npc.pos.col) for npc in npcs ],
+                               dtype=numpy.int64).reshape(-1, 2)
+        self.kind = numpy.array([ KINDS.get(type(npc), KIND_OTHER)
+                                  for npc in npcs ], dtype=numpy.int8)
+        self.alive = numpy.ones(len(npcs), dtype=bool)
+
+    def add(self, npc):
+        self.npcs.append(npc)
+        self.pos = numpy.append(self.pos, [ (npc.pos.row, npc.pos.col) ], 0)
+        self.kind = numpy.append(self.kind, KINDS.get(type(npc), KIND_OTHER))
+        self.alive = numpy.append(self.alive, True)
+
+    def remove(self, npc):
+        i = self.npcs.index(npc)
+        self.npcs[i] = None
+        self.alive[i] = False
+
+    def move(self, i, row, col):
+        self.pos[i] = (row, col)
+        self.npcs[i].pos = Point(row, col)
+
+    def compact(self):
+        '''
+        drop the NPCs that died since the last call
+        '''
+        if self.alive.all():
+            return
+        keep = numpy.flatnonzero(self.alive)
+        self.npcs = [ self.npcs[i] for i in keep ]
+        self.pos = self.pos[keep]
+        self.kind = self.kind[keep]
+        self.alive = self.alive[keep]
+
+
+class SwarmBackend:
+    '''
+    Runs a floor's NPC turns in batches. Bugs (attack if cardinally adjacent,
+    otherwise wander with probability 2/3) are handled entirely with array
+    operations; Segfaults have their attack check batched and then move one
+    at a time; all other NPCs take their turns normally. Moves are decided
+    simultaneously, so an NPC can't step into a tile that was occupied at the
+    start of the turn, and when several NPCs claim the same empty tile only
+    one of them gets it. The game tells the backend about NPCs that spawn
+    or die (see Game.add_npc and Game.remove_npc) and when the player
+    changes floors.
+    '''
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError("the vectorized NPC backend requires NumPy")
+        self.rng = numpy.random.default_rng(random.getrandbits(64))
+        self.arrays = None              # NPCArrays for the player's floor
+        self.walkable_cache = None      # ((floor, version, box), grid)
+
+    def __getstate__(self):
+        # the arrays are rebuilt from the NPCs after a restore
+        state = self.__dict__.copy()
+        state["arrays"] = None
+        state["walkable_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.arrays = None
+
+    def reset(self):
+        '''
+        forget the NPC arrays (they are rebuilt on the next turn)
+        '''
+        self.arrays = None
+
+    def added(self, npc):
+        if self.arrays is not None and npc.floor == self.arrays.floor:
+            self.arrays.add(npc)
+
+    def removed(self, npc):
+        if self.arrays is not None and npc.floor == self.arrays.floor:
+            self.arrays.remove(npc)
+
+    def floor_arrays(self, game):
+        '''
+        returns the NPC arrays for the player's floor (building them if the
+        player has just arrived)
+        '''
+        f = game.player.floor
+        if self.arrays is None or self.arrays.floor != f:
+            self.arrays = NPCArrays(f, [ npc for npc in game.npcs
+                                         if npc.floor == f ])
+        self.arrays.compact()
+        return self.arrays
+
+    def walkable_grid(self, floor, box):
+        '''
+        returns a boolean array telling which tiles in the given box
+        (top, left, bottom, right) are walkable for bugs and segfaults
+        '''
+        if self.walkable_cache is not None:
+            ((cfloor, version, cbox), grid) = self.walkable_cache
+            if cfloor is floor and version == floor.version and cbox == box:
+                return grid
+        (top, left, bottom, right) = box
+        table = numpy.zeros(256, dtype=bool)
+        for c in Bug.WALKABLE:
+            table[ord(c)] = True
+        rows = ''.join([ floor.base_row(row, left, right)
+                         for row in range(top, bottom) ])
+        tiles = numpy.frombuffer(rows.encode('latin-1'), dtype=numpy.uint8)
+        grid = table[tiles].reshape(bottom - top, right - left)
+        self.walkable_cache = ((floor, floor.version, box), grid)
+        return grid
+
+    def do_turns(self, game):
+        '''
+        run one turn for the NPCs near the player on the player's floor
+        '''
+        f = game.player.floor
+        floor = game.floors[f]
+        arrays = self.floor_arrays(game)
+        player = numpy.array([game.player.pos.row, game.player.pos.col])
+        chunks = numpy.abs(arrays.pos // CHUNK_SIZE - player // CHUNK_SIZE)
+        active = numpy.flatnonzero((chunks <= ACTIVE_CHUNK_RADIUS).all(1))
+        if len(active) == 0:
+            return
+        pos = arrays.pos[active]
+        kind = arrays.kind[active]
+        draws = self.rng.random((len(active), 2))
+
+        # attack checks
+        dist = numpy.abs(pos - player)
+        bugs = kind == KIND_BUG
+        segfaults = kind == KIND_SEGFAULT
+        attacks = (bugs & (dist.sum(1) == 1)) | \
+                  (segfaults & (draws[:, 0] < 0.75) & (dist.max(1) == 1))
+        for i in numpy.flatnonzero(attacks):
+            arrays.npcs[active[i]].attack_if_adjacent(game)
+
+        # bugs that aren't attacking wander with probability 2/3
+        movers = numpy.flatnonzero(bugs & ~attacks & (draws[:, 0] < 0.67))
+        if len(movers) > 0:
+            offsets = numpy.array(CARDINAL_OFFSETS)
+            targets = pos[movers] + \
+                    offsets[(draws[movers, 1] * 4).astype(numpy.int64)]
+            box = (max(int(targets[:, 0].min()), 0),
+                   max(int(targets[:, 1].min()), 0),
+                   min(int(targets[:, 0].max()) + 1, floor.height),
+                   min(int(targets[:, 1].max()) + 1, floor.width))
+            (top, left, bottom, right) = box
+
+            # throw out moves that leave the floor or hit a wall
+            inside = (targets[:, 0] >= top) & (targets[:, 0] < bottom) & \
+                     (targets[:, 1] >= left) & (targets[:, 1] < right)
+            movers = movers[inside]
+            targets = targets[inside] - [top, left]
+            walkable = self.walkable_grid(floor, box)
+            ok = walkable[targets[:, 0], targets[:, 1]]
+
+            # ... or a tile that's occupied by the player or another NPC
+            occupied = numpy.zeros((bottom - top, right - left), dtype=bool)
+            everyone = numpy.vstack([ arrays.pos[arrays.alive], player ])
+            inside = (everyone[:, 0] >= top) & (everyone[:, 0] < bottom) & \
+                     (everyone[:, 1] >= left) & (everyone[:, 1] < right)
+            occupied[everyone[inside, 0] - top, everyone[inside, 1] - left] = True
+            ok &= ~occupied[targets[:, 0], targets[:, 1]]
+            movers = movers[ok]
+            targets = targets[ok]
+
+            # only one bug gets each claimed tile
+            claims = targets[:, 0] * (right - left) + targets[:, 1]
+            (claims, winners) = numpy.unique(claims, return_index=True)
+            for i in winners:
+                arrays.move(active[movers[i]], int(targets[i, 0]) + top,
+                            int(targets[i, 1]) + left)
+
+        # everything else moves one NPC at a time (with a temporary index of
+        # occupied tiles so that collision checks don't scan every NPC)
+        others = active[~bugs & ~attacks]
+        if len(others) == 0:
+            return
+        index = {}
+        for npc in arrays.npcs:
+            index.setdefault((npc.pos.row, npc.pos.col), []).append(npc)
+        game.npc_index = index
+        try:
+            for i in others:
+                npc = arrays.npcs[i]
+                if npc is None:
+                    continue            # (died earlier this turn)
+                old = (npc.pos.row, npc.pos.col)
+                if arrays.kind[i] == KIND_SEGFAULT:
+                    npc.move(game)
+                else:
+                    npc.do_turn(game)
+                new = (npc.pos.row, npc.pos.col)
+                if new != old:
+                    arrays.pos[i] = new
+                    index[old].remove(npc)
+                    index.setdefault(new, []).append(npc)
+        finally:
+            game.npc_index = None
@@ -0,0 +1,78 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains the start-up timer behind the --timing flag, which
+    reports how long it takes to get to the first frame and which imports
+    that time goes to.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import builtins
+import sys
+import time
+
+REPORTED_IMPORTS = 12       # slowest imports listed in the report
+
+class StartupTimer:
+    '''
+    Records the time at which each start-up stage finishes and, once
+    watch_imports has been called, how long each module takes to import
+    (not counting the modules it imports in turn).
+    '''
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.stages = []        # (label, seconds since start)
+        self.imports = {}       # module name -> seconds spent importing it
+        self.nested = []        # time spent in nested imports, per level
+
+    def watch_imports(self):
+        '''
+        time every import from now on that actually loads a module
+        '''
+        original = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level > 0 or name in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+            self.nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = time.perf_counter() - start
+                own = elapsed - self.nested.pop()
+                self.imports[name] = self.imports.get(name, 0.0) + own
+                if len(self.nested) > 0:
+                    self.nested[-1] += elapsed
+
+        builtins.__import__ = timed_import
+
+    def mark(self, label):
+        self.stages.append((label, time.perf_counter() - self.start))
+
+    def report(self):
+        lines = [ "Start-up timing (ms since main.py started):" ]
+        for (label, elapsed) in self.stages:
+            lines.append("  %8.1f   %s" % (elapsed * 1000.0, label))
+        if len(self.imports) > 0:
+            total = sum(self.imports.values())
+            lines.append("Imports (%.1f ms total; own time, slowest first):"
+                         % (total * 1000.0))
+            slowest = sorted(self.imports.items(), key=lambda i: -i[1])
+            for (name, elapsed) in slowest[:REPORTED_IMPORTS]:
+                lines.append("  %8.1f   %s" % (elapsed * 1000.0, name))
+        return "\n".join(lines)
@@ -0,0 +1,63 @@
+"""
+    haxcs: an old-school roguelike with a computer science theme
+    Copyright (C) 2018 Mike Lam
+
+    This file contains regression tests for "mixed" games, where room floors
+    can follow cave floors (the room floor starts from the cave's downstairs).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import cave
+from game import Game
+
+@unittest.skipIf(cave.numpy is None, "the cave generator requires NumPy")
+class MixedFloorTest(unittest.TestCase):
+
+    def descend(self, width, height, floors):
+        '''
+        walk down a mixed game whose floors alternate between caves and
+        rooms, checking that every floor starts on its upstairs
+        '''
+        game = Game(width=width, height=height, floor_style="mixed")
+        game.choose_floor_style = lambda f: "caves" if f % 2 == 1 else "rooms"
+        for f in range(1, floors):
+            down = game.get_cur_floor().down
+            game.change_floor(f)
+            cfloor = game.get_cur_floor()
+            self.assertEqual(cfloor.up, down)
+            game.player.pos = cfloor.up
+            game.update_visibility()
+            self.assertEqual(cfloor.get_base_pt(cfloor.up), '<')
+        game.floors.close()
+
+    def test_default_size(self):
+        for seed in range(30):
+            random.seed(seed)
+            self.descend(80, 25, 7)
+
+    def test_large_floors(self):
+        for seed in range(3):
+            random.seed(seed)
+            self.descend(300, 200, 5)
+
+if __name__ == "__main__":
+    unittest.main()